@@ -0,0 +1,167 @@
+import tensorflow as tf
+
+
+@tf.keras.utils.register_keras_serializable(package='sleep')
+class SqueezeExcite1D(tf.keras.layers.Layer):
+    """沿时间轴的SE注意力模块
+
+    输入形状 (..., time, channels)：对时间轴求均值 (squeeze)，经两层全连接
+    得到通道权重 (excite)，再与输入逐通道相乘。替代原先基于 Lambda 的写法，
+    可以随模型一起序列化，load_model 时无需重新声明模型结构。
+    """
+
+    def __init__(self, ratio=4, activation='sigmoid', kernel_initializer='glorot_uniform', **kwargs):
+        super().__init__(**kwargs)
+        self.ratio = ratio
+        self.activation = activation
+        self.kernel_initializer = kernel_initializer
+
+    def build(self, input_shape):
+        num_filters = int(input_shape[-1])
+        self.squeeze_dense = tf.keras.layers.Dense(
+            units=num_filters // self.ratio, activation='relu',
+            kernel_initializer=self.kernel_initializer, name='squeeze'
+        )
+        self.excite_dense = tf.keras.layers.Dense(
+            units=num_filters, activation=self.activation,
+            kernel_initializer=self.kernel_initializer, name='excite'
+        )
+        squeezed_shape = tf.TensorShape(input_shape)[:-2].concatenate([1, num_filters])
+        with tf.name_scope(self.squeeze_dense.name):
+            self.squeeze_dense.build(squeezed_shape)
+        with tf.name_scope(self.excite_dense.name):
+            self.excite_dense.build(squeezed_shape[:-1].concatenate([num_filters // self.ratio]))
+        super().build(input_shape)
+
+    def call(self, inputs):
+        se = tf.reduce_mean(inputs, axis=-2, keepdims=True)
+        se = self.squeeze_dense(se)
+        se = self.excite_dense(se)
+        return inputs * se
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            'ratio': self.ratio,
+            'activation': self.activation,
+            'kernel_initializer': self.kernel_initializer,
+        })
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package='sleep')
+class WeightedCategoricalCrossentropy(tf.keras.losses.Loss):
+    """按类别加权的交叉熵（原 weighted_categorical_loss 的可序列化版本）"""
+
+    def __init__(self, weights=(1, 1.5, 1, 1, 1), name='weighted_categorical_crossentropy', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.weights = [float(w) for w in weights]
+
+    def call(self, y_true, y_pred):
+        # 混合精度下先转为float32再计算log，避免bfloat16精度不足导致的下溢
+        weights = tf.constant(self.weights, dtype=tf.float32)
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.cast(y_pred, tf.float32)
+        y_pred /= tf.reduce_sum(y_pred, axis=-1, keepdims=True)
+        y_pred = tf.clip_by_value(y_pred, tf.keras.backend.epsilon(), 1 - tf.keras.backend.epsilon())
+        loss = y_true * tf.math.log(y_pred) * weights
+        return -tf.reduce_sum(loss, axis=-1)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'weights': self.weights})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package='sleep')
+class FocalCategoricalLoss(tf.keras.losses.Loss):
+    """Focal Loss（原 focal_categorical_loss 的可序列化版本）
+
+    axis 为类别所在维：create_model 的 (n, seq_length, n_classes) 输出为 -1，
+    create_optimized_model 的 (n, n_classes, seq_length, 1) 输出为 1。
+    """
+
+    def __init__(self, alpha=(0.1, 0.3, 0.1, 0.2, 0.1), gamma=2.0, axis=-1, name='focal_categorical_loss', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.alpha = [float(a) for a in alpha]
+        self.gamma = float(gamma)
+        self.axis = int(axis)
+
+    def call(self, y_true, y_pred):
+        alpha = tf.constant(self.alpha, dtype=tf.float32)
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.cast(y_pred, tf.float32)
+        if self.axis != -1:
+            # 将类别维移到最后，以下统一按最后一维计算
+            y_true = tf.experimental.numpy.moveaxis(y_true, self.axis, -1)
+            y_pred = tf.experimental.numpy.moveaxis(y_pred, self.axis, -1)
+
+        # 计算交叉熵（对类别维求和，得到逐epoch的损失）
+        ce = -tf.reduce_sum(y_true * tf.math.log(tf.clip_by_value(y_pred, 1e-7, 1.0)), axis=-1)
+
+        # 计算概率调制因子
+        p_t = tf.reduce_sum(y_true * y_pred, axis=-1)
+        modulating_factor = tf.pow(1.0 - p_t, self.gamma)
+
+        # 应用类别权重
+        alpha_factor = tf.reduce_sum(alpha * y_true, axis=-1)
+
+        # 组合Focal Loss
+        return modulating_factor * alpha_factor * ce
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'alpha': self.alpha, 'gamma': self.gamma, 'axis': self.axis})
+        return config
+
+
+@tf.keras.utils.register_keras_serializable(package='sleep')
+class DistillationLoss(tf.keras.losses.Loss):
+    """知识蒸馏损失
+
+    y_true 为 one-hot 标签与教师模型log概率沿最后一维拼接 (..., 2 * n_classes)，
+    y_pred 为学生模型的logits。损失为
+    (1 - alpha) * focal(标签, softmax(logits)) + alpha * T^2 * KL(教师软目标 || 学生软输出)。
+    """
+
+    def __init__(self, n_classes=5, alpha=0.5, temperature=2.0, focal_alpha=(0.1, 0.3, 0.1, 0.2, 0.1),
+                 gamma=2.0, name='distillation_loss', **kwargs):
+        super().__init__(name=name, **kwargs)
+        self.n_classes = int(n_classes)
+        self.alpha = float(alpha)
+        self.temperature = float(temperature)
+        self.focal = FocalCategoricalLoss(focal_alpha, gamma)
+
+    def call(self, y_true, y_pred):
+        y_true = tf.cast(y_true, tf.float32)
+        logits = tf.cast(y_pred, tf.float32)
+        labels, teacher_log_probs = y_true[..., :self.n_classes], y_true[..., self.n_classes:]
+
+        hard_loss = self.focal.call(labels, tf.nn.softmax(logits))
+
+        # 教师log概率与logits只差一个常数，除以温度后的softmax即为软目标
+        soft_targets = tf.nn.softmax(teacher_log_probs / self.temperature)
+        log_student = tf.nn.log_softmax(logits / self.temperature)
+        log_targets = tf.math.log(tf.clip_by_value(soft_targets, 1e-7, 1.0))
+        soft_loss = tf.reduce_sum(soft_targets * (log_targets - log_student), axis=-1)
+
+        return (1 - self.alpha) * hard_loss + self.alpha * self.temperature ** 2 * soft_loss
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            'n_classes': self.n_classes,
+            'alpha': self.alpha,
+            'temperature': self.temperature,
+            'focal_alpha': self.focal.alpha,
+            'gamma': self.focal.gamma,
+        })
+        return config
+
+
+custom_objects = {
+    'SqueezeExcite1D': SqueezeExcite1D,
+    'WeightedCategoricalCrossentropy': WeightedCategoricalCrossentropy,
+    'FocalCategoricalLoss': FocalCategoricalLoss,
+    'DistillationLoss': DistillationLoss,
+}
@@ -0,0 +1,88 @@
+import numpy as np
+import tensorflow as tf
+
+from sequence import make_record_sequences, one_hot
+from sequence_cache import get_sequence
+
+
+def _record_sequences(fname, seq_length, n_classes):
+    """逐条记录读取NPZ并产生 (x_seq, y_seq) 序列"""
+    if isinstance(fname, bytes):
+        fname = fname.decode()
+    samples = np.load(fname)
+    x_seq, y_seq = make_record_sequences(samples['x'], samples['y'], seq_length, n_classes)
+    for j in range(len(x_seq)):
+        yield x_seq[j, ..., np.newaxis].astype(np.float32), y_seq[j]
+
+
+def make_sequence_dataset(fnames, seq_length=15, n_classes=5, Fs=100,
+                          batch_size=16, shuffle=True, shuffle_buffer=1024,
+                          cycle_length=4, seed=42):
+    """构建流式 tf.data 输入管道
+
+    每个NPZ记录只在被读取时加载，经并行 interleave 混合多条记录的序列，
+    再经 shuffle 缓冲区打乱后分批并预取。峰值内存只与
+    cycle_length 和 shuffle_buffer 有关，而与记录数量无关。
+    """
+    output_signature = (
+        tf.TensorSpec(shape=(seq_length, 30 * Fs, 1), dtype=tf.float32),
+        tf.TensorSpec(shape=(seq_length, n_classes), dtype=tf.float32),
+    )
+
+    files = tf.data.Dataset.from_tensor_slices(list(fnames))
+    if shuffle:
+        files = files.shuffle(len(fnames), seed=seed, reshuffle_each_iteration=True)
+
+    dataset = files.interleave(
+        lambda fname: tf.data.Dataset.from_generator(
+            _record_sequences,
+            args=(fname, seq_length, n_classes),
+            output_signature=output_signature
+        ),
+        cycle_length=cycle_length,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not shuffle
+    )
+
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+class CachedSequenceLoader(tf.keras.utils.Sequence):
+    """从内存映射序列缓存中按批次取数据
+
+    每个序列都是缓存数组上的视图，只有组成当前批次时才被拷贝。
+    """
+
+    def __init__(self, x, y, starts, seq_length=15, n_classes=5,
+                 batch_size=16, shuffle=True, seed=42):
+        super().__init__()
+        self.x = x
+        self.y = y
+        self.starts = np.asarray(starts)
+        self.seq_length = seq_length
+        self.n_classes = n_classes
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(self.starts))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return int(np.ceil(len(self.starts) / self.batch_size))
+
+    def __getitem__(self, idx):
+        batch = self.starts[self.order[idx * self.batch_size:(idx + 1) * self.batch_size]]
+        x_batch = np.empty((len(batch), self.seq_length, self.x.shape[1], 1), dtype=np.float32)
+        y_batch = np.empty((len(batch), self.seq_length), dtype=np.int32)
+        for i, start in enumerate(batch):
+            x_seq, y_seq = get_sequence(self.x, self.y, start, self.seq_length)
+            x_batch[i, ..., 0] = x_seq
+            y_batch[i] = y_seq
+        return x_batch, one_hot(y_batch, self.n_classes)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
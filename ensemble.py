@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import numpy as np
+
+from infer import load_inference_model, low_confidence_epochs, stride_arg
+from hypnogram_io import save_hypnogram
+from sequence import make_windows, epoch_probabilities, average_windows
+from result_cache import hash_path
+
+
+ARCHS = ("model", "lite", "tflite")
+
+
+def parse_member(spec):
+    """成员格式为 [arch:]path，arch 省略时 .tflite 为 tflite，其余为 create_model"""
+    arch, sep, path = spec.partition(":")
+    if not sep or arch not in ARCHS:
+        path = spec
+        arch = "tflite" if spec.endswith(".tflite") else "model"
+    return arch, path
+
+
+def expand_members(specs):
+    """展开成员中的通配符，例如 runs/fold_*/model.h5"""
+    members = []
+    for spec in specs:
+        arch, path = parse_member(spec)
+        paths = sorted(glob(path)) if any(c in path for c in "*?[") else [path]
+        if not paths:
+            raise FileNotFoundError(f"No checkpoint matches {path}")
+        members += [f"{arch}:{p}" for p in paths]
+    return members
+
+
+class EnsembleMember:
+    """集成中的一个模型，首次需要推理时才加载"""
+
+    def __init__(self, spec, weight=1.0, num_threads=None):
+        self.arch, self.path = parse_member(spec)
+        self.weight = weight
+        self.num_threads = num_threads
+        self.model_hash = hash_path(self.path)
+        self._model = None
+
+    @property
+    def name(self):
+        return f"{self.arch}:{self.path}"
+
+    def load(self):
+        if self._model is None:
+            if self.arch == "lite":
+                self._model = load_lite_model(self.path)
+            else:
+                backend = "tflite" if self.arch == "tflite" else "keras"
+                self._model = load_inference_model(self.path, backend, self.num_threads)
+        return self._model
+
+    def predict_epochs(self, inputs, starts, n_epochs):
+        """在共享的各块窗口张量上推理，返回逐epoch平均概率 (n_epochs, n_classes)"""
+        model = self.load()
+        window_probs = np.concatenate([epoch_probabilities(model.predict(chunk, verbose=0)) for chunk in inputs])
+        return average_windows(window_probs, starts, n_epochs)
+
+
+def load_lite_model(model_path, seq_length=15):
+    """加载 model_lite.create_optimized_model 的检查点"""
+    from keras_backend import KerasPredictor
+    from model_lite import load_optimized_model
+    return KerasPredictor(load_optimized_model(model_path, seq_length))
+
+
+class MemberCache:
+    """按 (成员检查点, 夜晚数据, 推理参数) 缓存各成员的逐epoch概率
+
+    修改融合权重时直接读取缓存，不再重新运行模型。
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(member, night_hash, seq_length, stride):
+        params = f"{member.arch}|{member.model_hash}|{night_hash}|{seq_length}|{stride}"
+        return hashlib.sha1(params.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key):
+        path = self._path(key)
+        return np.load(path) if os.path.exists(path) else None
+
+    def put(self, key, probabilities):
+        # 先写临时文件再替换，并发运行时不会读到半成品
+        tmp_path = self._path(key) + f".{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, probabilities.astype(np.float32))
+        os.replace(tmp_path, self._path(key))
+
+
+def fuse(member_probs, weights):
+    """按权重对各成员的逐epoch概率加权平均"""
+    weights = np.asarray(weights, dtype=np.float64)
+    weights = weights / weights.sum()
+    return np.tensordot(weights, np.stack(member_probs), axes=1).astype(np.float32)
+
+
+def run_ensemble(members, x, night_hash, cache, executor, seq_length=15, stride=None):
+    """对一晚数据运行全部成员，返回各成员的逐epoch概率列表
+
+    窗口张量只准备一次并由所有成员共享；缓存未命中的成员在线程池中并行推理
+    （Keras 推理与 TFLite invoke 都会释放GIL）。
+    """
+    keys = [cache.key(m, night_hash, seq_length, stride) for m in members]
+    member_probs = [cache.get(key) for key in keys]
+    missing = [i for i, probs in enumerate(member_probs) if probs is None]
+    if missing:
+        chunks, starts = make_windows(x, seq_length, stride)
+        inputs = [np.ascontiguousarray(windows[..., np.newaxis], dtype=np.float32) for windows in chunks]
+        # 模型在主线程中依次加载，避免并发构建Keras图
+        for i in missing:
+            members[i].load()
+        futures = {i: executor.submit(members[i].predict_epochs, inputs, starts, len(x)) for i in missing}
+        for i, future in futures.items():
+            member_probs[i] = future.result()
+            cache.put(keys[i], member_probs[i])
+    return member_probs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=str, nargs="+", default=["model.h5"],
+                        help="Checkpoints as [arch:]path with arch in model/lite/tflite; "
+                             "globs such as 'model:runs/fold_*/model.h5' add one member per match")
+    parser.add_argument("--weights", type=float, nargs="+", default=None,
+                        help="Fusion weight per member after glob expansion (default: equal weights)")
+    parser.add_argument("--data_path", type=str, default=None,
+                        help="NPZ night to score")
+    parser.add_argument("--input_dir", "--input-dir", type=str, default=None,
+                        help="Score every NPZ night in this directory instead of --data_path")
+    parser.add_argument("--output_dir", "--output-dir", type=str, default="hypnograms",
+                        help="Where fused per-night hypnograms are written")
+    parser.add_argument("--cache_dir", type=str, default="ensemble_cache",
+                        help="Per-member probabilities are cached here; changing --weights reuses them")
+    parser.add_argument("--stride", type=stride_arg, default=15,
+                        help="Window stride in epochs (1-15); < 15 averages overlapping windows")
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="Number of CPU threads per TFLite interpreter")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of members run in parallel (default: all)")
+    parser.add_argument("--confidence_threshold", type=float, default=0.6,
+                        help="Epochs whose fused top probability is below this are flagged as low-confidence")
+    args = parser.parse_args()
+
+    specs = expand_members(args.members)
+    weights = args.weights if args.weights is not None else [1.0] * len(specs)
+    if len(weights) != len(specs):
+        raise ValueError(f"{len(weights)} weights given for {len(specs)} members: {specs}")
+    members = [EnsembleMember(spec, w, args.num_threads) for spec, w in zip(specs, weights)]
+    for m in members:
+        print(f"member {m.name} weight {m.weight:g}")
+
+    if args.input_dir is not None:
+        fnames = sorted(glob(os.path.join(args.input_dir, "*.npz")))
+    elif args.data_path is not None:
+        fnames = [args.data_path]
+    else:
+        parser.error("one of --data_path or --input_dir is required")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache = MemberCache(args.cache_dir)
+    with ThreadPoolExecutor(max_workers=args.workers or len(members)) as executor:
+        for npz_path in fnames:
+            start_time = time.perf_counter()
+            x = np.load(npz_path)["x"]
+            member_probs = run_ensemble(members, x, hash_path(npz_path), cache, executor, stride=args.stride)
+            probabilities = fuse(member_probs, [m.weight for m in members])
+            low_confidence = low_confidence_epochs(probabilities, args.confidence_threshold)
+            save_hypnogram(os.path.join(args.output_dir, os.path.basename(npz_path)), probabilities, low_confidence)
+            print(f"{os.path.basename(npz_path)}: {len(probabilities)} epochs, "
+                  f"{len(low_confidence)} low-confidence, {time.perf_counter() - start_time:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import argparse
+import os
+from glob import glob
+import numpy as np
+import tensorflow as tf
+from sklearn.metrics import cohen_kappa_score
+
+from model import load_model
+from sequence import make_sequences, epoch_probabilities
+from split import load_fold, resolve_data_path, DEFAULT_DATA_PATH
+from tflite_backend import TFLiteModel
+
+
+def load_keras_model(model_path, arch='model', seq_length=15):
+    """加载待导出的Keras模型 (arch: model=create_model, lite=create_optimized_model)"""
+    if arch == 'model':
+        return load_model(model_path, seq_length=seq_length)
+    from model_lite import load_optimized_model
+    return load_optimized_model(model_path, seq_length=seq_length)
+
+
+def unroll_recurrent(model):
+    """克隆模型并将LSTM展开 (unroll=True)
+
+    两种模型的LSTM都使用了非标准激活 (relu / hard_sigmoid)，无法转换为
+    TFLite 融合LSTM算子，整数量化校准会失败。序列长度固定为15，展开后
+    只剩 MatMul / Add / 激活等基础算子，均可全整数量化。
+    """
+    def clone_function(layer):
+        config = layer.get_config()
+        if isinstance(layer, tf.keras.layers.LSTM):
+            config['unroll'] = True
+        return layer.__class__.from_config(config)
+
+    unrolled = tf.keras.models.clone_model(model, clone_function=clone_function)
+    unrolled.set_weights(model.get_weights())
+    return unrolled
+
+
+def load_record_sequences(fnames, seq_length=15, max_sequences=None, seed=42):
+    """读取若干NPZ记录的序列及其逐epoch标签"""
+    x_seq, y_seq = [], []
+    for fname in fnames:
+        samples = np.load(fname)
+        x_seq.append(make_sequences(samples['x'], seq_length))
+        y_seq.append(make_sequences(samples['y'], seq_length))
+    x_seq = np.concatenate(x_seq)[..., np.newaxis].astype(np.float32)
+    y_seq = np.concatenate(y_seq)
+    if max_sequences is not None and len(x_seq) > max_sequences:
+        idx = np.sort(np.random.default_rng(seed).choice(len(x_seq), max_sequences, replace=False))
+        x_seq, y_seq = x_seq[idx], y_seq[idx]
+    return x_seq, y_seq
+
+
+def convert_int8(model, calib_x, seq_length=15):
+    """全整数量化转换，校准数据为代表性的Sleep-EDF序列"""
+    input_shape = (1, seq_length) + tuple(model.input_shape[2:])
+    concrete_fn = tf.function(lambda x: model(x, training=False)).get_concrete_function(
+        tf.TensorSpec(input_shape, tf.float32)
+    )
+
+    def representative_dataset():
+        for i in range(len(calib_x)):
+            yield [calib_x[i:i + 1]]
+
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete_fn], model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+    return converter.convert()
+
+
+def stage_kappa(model, x_seq, y_seq):
+    y_pred = epoch_probabilities(model.predict(x_seq, batch_size=16, verbose=0)).argmax(-1)
+    return cohen_kappa_score(y_seq.reshape(-1), y_pred.reshape(-1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, default="model.h5",
+                        help="Keras weights (.h5) or SavedModel directory to export.")
+    parser.add_argument("--arch", type=str, default="model", choices=["model", "lite"],
+                        help="Architecture of the checkpoint: create_model or create_optimized_model.")
+    parser.add_argument("--data_path", type=str, default=None,
+                        help="Directory of preprocessed NPZ files (default: the split manifest's data_path, "
+                             f"else {DEFAULT_DATA_PATH}).")
+    parser.add_argument("--output", type=str, default="model_int8.tflite")
+    parser.add_argument("--split_manifest", type=str, default=None,
+                        help="Calibrate on the fold's training records and evaluate on its test records.")
+    parser.add_argument("--fold", type=int, default=0)
+    parser.add_argument("--calib_records", type=int, default=10,
+                        help="Number of records used for calibration (without a split manifest).")
+    parser.add_argument("--eval_records", type=int, default=10,
+                        help="Number of held-out records used for the accuracy gate (without a split manifest).")
+    parser.add_argument("--calib_sequences", type=int, default=200)
+    parser.add_argument("--eval_sequences", type=int, default=1000)
+    parser.add_argument("--max_kappa_drop", type=float, default=0.02,
+                        help="Refuse to write the int8 model if kappa drops by more than this.")
+    parser.add_argument("--seq_length", type=int, default=15)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    resolve_data_path(args)
+
+    if args.split_manifest is not None:
+        calib_fnames, _, eval_fnames = load_fold(args.split_manifest, args.fold, args.data_path)
+    else:
+        fnames = np.array(sorted(glob(os.path.join(args.data_path, '*.npz'))))
+        np.random.default_rng(args.seed).shuffle(fnames)
+        calib_fnames = fnames[:args.calib_records]
+        eval_fnames = fnames[args.calib_records:args.calib_records + args.eval_records]
+    if len(calib_fnames) == 0 or len(eval_fnames) == 0:
+        raise ValueError("Not enough records for calibration and evaluation.")
+
+    model = unroll_recurrent(load_keras_model(args.model_path, args.arch, args.seq_length))
+    calib_x, _ = load_record_sequences(calib_fnames, args.seq_length, args.calib_sequences, args.seed)
+    eval_x, eval_y = load_record_sequences(eval_fnames, args.seq_length, args.eval_sequences, args.seed)
+    print(f"Calibration: {len(calib_x)} sequences from {len(calib_fnames)} records")
+    print(f"Evaluation:  {len(eval_x)} sequences from {len(eval_fnames)} records")
+
+    tflite_model = convert_int8(model, calib_x, args.seq_length)
+
+    kappa_float = stage_kappa(model, eval_x, eval_y)
+    kappa_int8 = stage_kappa(TFLiteModel(model_content=tflite_model), eval_x, eval_y)
+    kappa_drop = kappa_float - kappa_int8
+    print(f"kappa float32: {kappa_float:.4f}")
+    print(f"kappa int8:    {kappa_int8:.4f} (drop {kappa_drop:.4f}, max {args.max_kappa_drop:.4f})")
+
+    if kappa_drop > args.max_kappa_drop:
+        raise SystemExit(f"int8 model rejected: kappa drop {kappa_drop:.4f} > {args.max_kappa_drop:.4f}, "
+                         f"{args.output} not written")
+
+    with open(args.output, 'wb') as f:
+        f.write(tflite_model)
+    print(f"Saved {args.output} ({len(tflite_model) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
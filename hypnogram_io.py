@@ -0,0 +1,38 @@
+import json
+import os
+import numpy as np
+
+
+def save_hypnogram(output_path, probabilities, low_confidence=None, params=None):
+    """保存逐epoch的阶段索引、float16概率矩阵与低置信度epoch索引
+
+    NPZ 包含 stages (int8)、probabilities (float16) 和 low_confidence (int32)；
+    给定 params 时一并以JSON字符串保存生成该结果的推理参数。先写临时文件再
+    替换，避免半成品。
+    """
+    if low_confidence is None:
+        low_confidence = np.empty(0, dtype=np.int64)
+    arrays = {}
+    if params is not None:
+        arrays["params"] = np.array(json.dumps(params, sort_keys=True))
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, stages=np.argmax(probabilities, axis=-1).astype(np.int8),
+                 probabilities=probabilities.astype(np.float16),
+                 low_confidence=np.asarray(low_confidence, dtype=np.int32), **arrays)
+    os.replace(tmp_path, output_path)
+
+
+def load_hypnogram(path):
+    """读取 save_hypnogram 保存的NPZ，返回 {数组名: 数组}"""
+    with np.load(path) as data:
+        return {k: data[k] for k in data.files}
+
+
+def saved_params(path):
+    """save_hypnogram 保存的推理参数JSON字符串；文件不存在、损坏或未保存参数时返回 None"""
+    try:
+        with np.load(path) as data:
+            return str(data["params"]) if "params" in data.files else None
+    except (OSError, ValueError):
+        return None
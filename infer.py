@@ -1,128 +1,314 @@
 import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from glob import glob
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras import backend as K
-from tensorflow.keras.models import load_model
 
+from sequence import make_sequences, epoch_probabilities, make_windows, average_windows, check_stride
+from sleepstage import stage_names
+from result_cache import HypnogramCache, cache_key, hash_path
+from hypnogram_io import save_hypnogram, saved_params
 
-# 1. 重新定义模型所需的函数和结构
-def weighted_categorical_crossentropy(weights):
-    weights = tf.Variable(weights, dtype=tf.float32)
+# 本模块只在加载Keras模型时才导入TensorFlow：数据准备、阶段映射、参数解析
+# 以及 tflite 后端都不会付出 TensorFlow 的导入开销（见 python -X importtime infer.py）
 
-    def loss(y_true, y_pred):
-        # 缩放预测值，使每个样本的类别概率总和为1
-        y_pred /= tf.reduce_sum(y_pred, axis=-1, keepdims=True)
 
-        # 裁剪以防止NaN和Inf
-        y_pred = tf.clip_by_value(y_pred, 1e-7, 1 - 1e-7)
+# 1. 加载模型（结构与自定义层统一由 model.py / custom_layers.py 提供）
+class StartupProfiler:
+    """记录启动各阶段耗时"""
 
-        # 计算加权损失
-        loss_val = y_true * tf.math.log(y_pred) * weights
-        loss_val = -tf.reduce_sum(loss_val, axis=-1)
-        return loss_val
+    def __init__(self):
+        self.phases = []
 
-    return loss
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.phases.append((name, time.perf_counter() - start))
 
+    def report(self):
+        total = sum(t for _, t in self.phases)
+        print("\n启动耗时分析:")
+        for name, t in self.phases:
+            print(f"  {name:<20} {t:7.3f} s ({t / total * 100:5.1f}%)")
+        print(f"  {'total':<20} {total:7.3f} s")
 
-def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio):
-    # 1D卷积
-    x = tf.keras.layers.Conv1D(filters=num_filters, kernel_size=kernel_size,
-                               strides=strides, padding='same',
-                               kernel_initializer='he_normal')(inputs)
-    x = tf.keras.layers.BatchNormalization()(x)
-    x = tf.keras.layers.Activation('relu')(x)
-    x = tf.keras.layers.Conv1D(filters=num_filters, kernel_size=kernel_size,
-                               strides=strides, padding='same',
-                               kernel_initializer='he_normal')(x)
-    x = tf.keras.layers.BatchNormalization()(x)
 
-    # SE块 - 使用TF内置函数代替K.mean
-    se = tf.keras.layers.Lambda(
-        lambda x: tf.reduce_mean(x, axis=-2, keepdims=True)
-    )(x)
-    se = tf.keras.layers.Dense(units=num_filters // ratio)(se)
-    se = tf.keras.layers.Activation('relu')(se)
-    se = tf.keras.layers.Dense(units=num_filters)(se)
-    se = tf.keras.layers.Activation('sigmoid')(se)
-    x = tf.keras.layers.multiply([x, se])
+def load_model_with_weights(model_path, warmup=False, profiler=None):
+    """加载Keras模型并包装为固定输入签名的预测器
 
-    # 跳跃连接
-    x_skip = tf.keras.layers.Conv1D(filters=num_filters, kernel_size=1,
-                                    strides=1, padding='same',
-                                    kernel_initializer='he_normal')(inputs)
-    x_skip = tf.keras.layers.BatchNormalization()(x_skip)
+    warmup=True 时用全零批次提前完成图追踪，之后的首次预测不再付出追踪开销。
+    """
+    profiler = profiler or StartupProfiler()
+    with profiler.phase("import tensorflow"):
+        import tensorflow as tf
+    with profiler.phase("import model"):
+        from model import build_model, load_model_weights
+        from keras_backend import KerasPredictor
 
-    x = tf.keras.layers.Add()([x, x_skip])
-    x = tf.keras.layers.Activation('relu')(x)
-    return x
+    # 与 model.load_model 相同的两步，分别计时（SavedModel 在第一步即载入权重）
+    with profiler.phase("build model"):
+        model = build_model(model_path)
+    with profiler.phase("load_weights"):
+        load_model_weights(model, model_path)
 
+    predictor = KerasPredictor(model)
+    if warmup:
+        with profiler.phase("warm-up trace"):
+            predictor.warmup()
+    return predictor
 
-def create_model(Fs=100, n_classes=5, seq_length=15, summary=False):
-    # 注意：输入形状调整为 (seq_length, 3000, 1)
-    x_input = tf.keras.Input(shape=(seq_length, 30 * Fs, 1))
 
-    x = resnet_se_block(x_input, 32, 3, 1, 4)
-    x = tf.keras.layers.MaxPool2D(pool_size=(4, 1), strides=(4, 1),
-                                  padding='same', data_format='channels_last')(x)
+def load_inference_model(model_path, backend="keras", num_threads=None, warmup=False, profiler=None):
+    """按后端加载模型；tflite 后端不会导入 tensorflow.keras"""
+    if backend == "tflite":
+        from tflite_backend import TFLiteModel
+        with (profiler or StartupProfiler()).phase("load tflite"):
+            return TFLiteModel(model_path, num_threads=num_threads)
+    return load_model_with_weights(model_path, warmup, profiler)
 
-    x = resnet_se_block(x, 64, 5, 1, 4)
-    x = tf.keras.layers.MaxPool2D(pool_size=(4, 1), strides=(4, 1),
-                                  padding='same', data_format='channels_last')(x)
 
-    x = resnet_se_block(x, 128, 7, 1, 4)
-    # 使用TF内置函数代替K.mean
-    x = tf.keras.layers.Lambda(
-        lambda x: tf.reduce_mean(x, axis=-2, keepdims=False)
-    )(x)
-
-    x = tf.keras.layers.Dropout(rate=0.5)(x)
-
-    # LSTM
-    x = tf.keras.layers.LSTM(units=64, dropout=0.5,
-                             activation='relu', return_sequences=True)(x)
-
-    # 分类
-    x_out = tf.keras.layers.Dense(units=n_classes, activation='softmax')(x)
-
-    model = tf.keras.models.Model(x_input, x_out)
-    return model
-
-
-# 2. 加载模型的权重而不是整个模型
-def load_model_with_weights(model_path):
-    # 先创建一个新模型实例
-    model = create_model(seq_length=15)
-
-    # 加载权重
-    model.load_weights(model_path)
-    return model
-
-
-# 3. 数据准备和推理函数
+# 2. 数据准备和推理函数
 def prepare_inference_data(npz_path, seq_length=15):
     """准备推理数据"""
     data = np.load(npz_path)
     x = data["x"]
 
     # 序列化处理
-    sequences = []
-    start_index = 0
-    while start_index + seq_length <= len(x):
-        seq = x[start_index:start_index + seq_length]
-        sequences.append(seq)
-        start_index += seq_length
-
-    x_seq = np.array(sequences)
+    x_seq = make_sequences(x, seq_length)
     x_seq = np.expand_dims(x_seq, axis=-1)  # 添加通道维度
     return x_seq
 
 
 def run_inference(model, input_data):
     """运行模型推理"""
-    return model.predict(input_data)
+    return model.predict(input_data, verbose=0)
 
 
-# 4. 主函数
+def predict_windows(model, chunks):
+    """逐块推理 make_windows 返回的窗口，拼接为 (n_windows, seq_length, n_classes)"""
+    return np.concatenate([epoch_probabilities(run_inference(model, windows[..., np.newaxis]))
+                           for windows in chunks])
+
+
+def predict_epochs(model, x, seq_length=15, stride=None):
+    """滑动窗口推理，返回整夜逐epoch的平均概率 (n_epochs, n_classes)
+
+    窗口以视图形式送入 predict；重叠窗口对同一epoch的softmax输出取平均，
+    末尾不足一个窗口的epoch由末尾对齐窗口覆盖，不再被丢弃。
+    """
+    chunks, starts = make_windows(x, seq_length, stride)
+    return average_windows(predict_windows(model, chunks), starts, len(x))
+
+
+def stride_arg(value):
+    """argparse 类型：窗口步长须在 1..15 之间"""
+    try:
+        return check_stride(int(value))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def low_confidence_epochs(probabilities, threshold=0.6):
+    """最大类别概率低于阈值的epoch索引"""
+    return np.flatnonzero(probabilities.max(axis=-1) < threshold)
+
+
+def rescore_epochs(model, x, probabilities, epochs, seq_length=15):
+    """第二遍打分：只对低置信度epoch使用更长的上下文重新推理
+
+    对每个待重打分的epoch取包含它的全部窗口（步长1），相当于前后各
+    seq_length-1 个epoch的上下文，平均后替换第一遍的概率。model 可以是
+    比第一遍更重的模型；其余epoch保持不变，不额外付出计算。
+    """
+    probabilities = probabilities.copy()
+    if len(epochs) == 0:
+        return probabilities
+    # 步长为1时所有窗口都在第一块中，不存在单独的末尾窗口
+    (windows,), starts = make_windows(x, seq_length, stride=1)
+    # 只保留至少覆盖一个待重打分epoch的窗口
+    covers = np.zeros(len(x) + seq_length, dtype=bool)
+    covers[epochs] = True
+    covered = np.convolve(covers, np.ones(seq_length, dtype=int))[seq_length - 1:][:len(starts)]
+    keep = np.flatnonzero(covered[starts] > 0)
+    window_probs = epoch_probabilities(run_inference(model, windows[keep][..., np.newaxis]))
+    rescored = average_windows(window_probs, starts[keep], len(x), allow_uncovered=True)
+    probabilities[epochs] = rescored[epochs]
+    return probabilities
+
+
+def score_epochs(model, x, stride=None, confidence_threshold=0.6, rescore_model=None):
+    """第一遍打分并标记低置信度epoch；给定 rescore_model 时再对它们做第二遍打分"""
+    probabilities = predict_epochs(model, x, stride=stride)
+    low_confidence = low_confidence_epochs(probabilities, confidence_threshold)
+    if rescore_model is not None:
+        probabilities = rescore_epochs(rescore_model, x, probabilities, low_confidence)
+    return probabilities, low_confidence
+
+
+# 3. 结果缓存：同一模型、同一晚数据、同一参数只运行一次网络（需显式指定目录）
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sleep_staging", "hypnograms")
+
+
+def open_result_cache(cache_dir=None, cache_size_mb=1024):
+    """cache_dir 为 None 或空时不使用缓存"""
+    if not cache_dir:
+        return None
+    return HypnogramCache(cache_dir, int(cache_size_mb * (1 << 20)))
+
+
+def scoring_params(backend="keras", stride=15, confidence_threshold=0.6,
+                   rescore_model_path=None, rescore_backend="keras"):
+    """影响打分结果的推理参数（第二遍模型按路径记录）"""
+    rescore = rescore_model_path
+    if rescore_model_path not in (None, "same"):
+        rescore = f"{rescore_backend}:{rescore_model_path}"
+    return {"backend": backend, "stride": stride, "seq_length": 15,
+            "confidence_threshold": confidence_threshold, "rescore": rescore}
+
+
+def result_key(model_hash, npz_path, backend="keras", stride=15, confidence_threshold=0.6,
+               rescore_model_path=None, rescore_backend="keras"):
+    params = scoring_params(backend, stride, confidence_threshold, rescore_model_path, rescore_backend)
+    if rescore_model_path not in (None, "same"):
+        params["rescore"] = f"{rescore_backend}:{hash_path(rescore_model_path)}"
+    return cache_key(model_hash, hash_path(npz_path), params)
+
+
+def score_npz(npz_path, model_path="model.h5", backend="keras", stride=15, confidence_threshold=0.6,
+              rescore_model_path=None, rescore_backend="keras", num_threads=None,
+              cache_dir=None, cache_size_mb=1024):
+    """对一晚NPZ打分，返回 (stages, probabilities, low_confidence)
+
+    供报告类脚本重绘图表时调用：给定 cache_dir（如 DEFAULT_CACHE_DIR）时先查
+    结果缓存，命中时既不加载模型也不运行网络。
+    """
+    cache = open_result_cache(cache_dir, cache_size_mb)
+    key = None
+    if cache is not None:
+        key = result_key(hash_path(model_path), npz_path, backend, stride, confidence_threshold,
+                         rescore_model_path, rescore_backend)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached["stages"], cached["probabilities"].astype(np.float32), cached["low_confidence"]
+
+    model = load_inference_model(model_path, backend, num_threads)
+    rescore_model = None
+    if rescore_model_path is not None:
+        rescore_model = load_rescore_model(rescore_model_path, rescore_backend, num_threads, model)
+    x = np.load(npz_path)["x"]
+    probabilities, low_confidence = score_epochs(model, x, stride, confidence_threshold, rescore_model)
+    if cache is not None:
+        cache.put(key, probabilities, low_confidence)
+    return np.argmax(probabilities, axis=-1), probabilities, low_confidence
+
+
+# 4. 批量推理：进程池中每个进程只加载一次模型
+_worker_model = None
+_worker_rescore_model = None
+
+
+def _init_worker(model_path, backend, num_threads, rescore_model_path=None, rescore_backend="keras"):
+    global _worker_model, _worker_rescore_model
+    uses_keras = backend == "keras" or (rescore_model_path is not None and rescore_backend == "keras")
+    if uses_keras and num_threads:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    _worker_model = load_inference_model(model_path, backend, num_threads, warmup=True)
+    if rescore_model_path is not None:
+        _worker_rescore_model = load_rescore_model(rescore_model_path, rescore_backend, num_threads, _worker_model)
+
+
+def load_rescore_model(rescore_model_path, backend, num_threads, model):
+    """第二遍使用的模型；"same" 表示复用第一遍的模型，只加长上下文"""
+    if rescore_model_path == "same":
+        return model
+    return load_inference_model(rescore_model_path, backend, num_threads)
+
+
+def is_up_to_date(npz_path, output_path, params, *model_paths):
+    """输出文件比输入NPZ和所有模型都新、且由相同推理参数生成时视为最新"""
+    if not os.path.exists(output_path):
+        return False
+    output_mtime = os.path.getmtime(output_path)
+    inputs = [npz_path] + [p for p in model_paths if p is not None and os.path.exists(p)]
+    if not all(output_mtime >= os.path.getmtime(p) for p in inputs):
+        return False
+    return saved_params(output_path) == json.dumps(params, sort_keys=True)
+
+
+def score_night(task):
+    npz_path, output_path, params, cache_dir, cache_size_mb, key = task
+    start_time = time.perf_counter()
+    x = np.load(npz_path)["x"]
+    probabilities, low_confidence = score_epochs(_worker_model, x, params["stride"], params["confidence_threshold"],
+                                                 _worker_rescore_model)
+    save_hypnogram(output_path, probabilities, low_confidence, params)
+    cache = open_result_cache(cache_dir, cache_size_mb)
+    if cache is not None:
+        cache.put(key, probabilities, low_confidence)
+    return os.path.basename(npz_path), len(probabilities), len(low_confidence), time.perf_counter() - start_time
+
+
+def check_model_paths(*model_paths):
+    """在启动进程池之前确认模型文件存在（"same" 表示复用第一遍模型）"""
+    for path in model_paths:
+        if path is not None and path != "same" and not os.path.exists(path):
+            raise FileNotFoundError(f"Model not found: {path}")
+
+
+def run_batch(args):
+    check_model_paths(args.model_path, args.rescore_model_path)
+    os.makedirs(args.output_dir, exist_ok=True)
+    fnames = sorted(glob(os.path.join(args.input_dir, "*.npz")))
+
+    cache = open_result_cache(args.cache_dir, args.cache_size_mb)
+    model_hash = hash_path(args.model_path) if cache is not None else None
+    # 保存在每个输出中；任一推理参数或模型路径改变时重新打分
+    params = dict(scoring_params(args.backend, args.stride, args.confidence_threshold,
+                                 args.rescore_model_path, args.rescore_backend),
+                  model_path=args.model_path)
+
+    tasks = []
+    n_cached = 0
+    for npz_path in fnames:
+        output_path = os.path.join(args.output_dir, os.path.basename(npz_path))
+        if is_up_to_date(npz_path, output_path, params, args.model_path, args.rescore_model_path):
+            continue
+        key = None
+        if cache is not None:
+            key = result_key(model_hash, npz_path, args.backend, args.stride, args.confidence_threshold,
+                             args.rescore_model_path, args.rescore_backend)
+            cached = cache.get(key)
+            if cached is not None:
+                save_hypnogram(output_path, cached["probabilities"], cached["low_confidence"], params)
+                n_cached += 1
+                continue
+        tasks.append((npz_path, output_path, params, args.cache_dir, args.cache_size_mb, key))
+    n_skipped = len(fnames) - len(tasks) - n_cached
+    print(f"{len(fnames)} nights found, {n_skipped} up to date, {n_cached} from cache, {len(tasks)} to score")
+    if not tasks:
+        return
+
+    num_threads = args.num_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    # TensorFlow 不支持 fork 后继续使用，统一使用 spawn。初始化（加载模型）失败时
+    # ProcessPoolExecutor 抛出 BrokenProcessPool 结束运行，而不会像 Pool 那样反复重启进程
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=_init_worker,
+                             initargs=(args.model_path, args.backend, num_threads,
+                                       args.rescore_model_path, args.rescore_backend)) as executor:
+        futures = [executor.submit(score_night, task) for task in tasks]
+        for i, future in enumerate(as_completed(futures)):
+            name, n_epochs, n_low, elapsed = future.result()
+            print(f"[{i + 1}/{len(tasks)}] {name}: {n_epochs} epochs, {n_low} low-confidence, {elapsed:.2f} s")
+
+
+# 5. 主函数
 def main():
     # 解析参数
     parser = argparse.ArgumentParser()
@@ -131,32 +317,96 @@ def main():
     parser.add_argument("--data_path", type=str,
                         default="E:/DREAMT base/sleep-edf/sleep-edf-database-expanded-1.0.0/sleep-cassette/eeg_fpz_cz/SC4032E0.npz",
                         help="Path to test NPZ file")
+    parser.add_argument("--backend", type=str, default="keras", choices=["keras", "tflite"],
+                        help="keras: build the Keras model; tflite: run an exported .tflite model (XNNPACK)")
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="Number of CPU threads for the TFLite interpreter")
+    parser.add_argument("--stride", type=stride_arg, default=15,
+                        help="Window stride in epochs (1-15); < 15 averages overlapping windows")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Trace the predict function before the first night is scored")
+    parser.add_argument("--profile", action="store_true",
+                        help="Report how startup time splits between import, model build, weights and first predict")
+    parser.add_argument("--confidence_threshold", type=float, default=0.6,
+                        help="Epochs whose top stage probability is below this are flagged as low-confidence")
+    parser.add_argument("--rescore_model_path", type=str, default=None,
+                        help="Rescore low-confidence epochs with this (heavier) model and every window "
+                             "covering them; 'same' reuses --model_path with the longer context only")
+    parser.add_argument("--rescore_backend", type=str, default="keras", choices=["keras", "tflite"])
+    parser.add_argument("--output", type=str, default=None,
+                        help="Save stages, float16 probabilities and low-confidence epochs of --data_path to this NPZ")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Content-addressed result cache checked before running the network, "
+                             f"e.g. {DEFAULT_CACHE_DIR} (disabled unless given)")
+    parser.add_argument("--cache_size_mb", type=float, default=1024,
+                        help="Least recently used results are evicted beyond this size")
+    parser.add_argument("--input_dir", "--input-dir", type=str, default=None,
+                        help="Score every NPZ night in this directory instead of --data_path")
+    parser.add_argument("--output_dir", "--output-dir", type=str, default="hypnograms",
+                        help="Where per-night hypnograms are written (with --input_dir)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (with --input_dir)")
     args = parser.parse_args()
 
-    # 创建模型并加载权重
-    model = load_model_with_weights(args.model_path)
-
-    # 准备数据
-    X_inference = prepare_inference_data(args.data_path)
-
-    # 运行推理
-    predictions = run_inference(model, X_inference)
+    if args.input_dir is not None:
+        run_batch(args)
+        return
+
+    start_time = time.perf_counter()
+    profiler = StartupProfiler()
+
+    # 先查结果缓存，命中时不加载模型
+    cache = open_result_cache(args.cache_dir, args.cache_size_mb)
+    cached = None
+    if cache is not None:
+        with profiler.phase("cache lookup"):
+            key = result_key(hash_path(args.model_path), args.data_path, args.backend, args.stride,
+                             args.confidence_threshold, args.rescore_model_path, args.rescore_backend)
+            cached = cache.get(key)
+
+    if cached is not None:
+        probabilities = cached["probabilities"].astype(np.float32)
+        low_confidence = cached["low_confidence"]
+        print(f"命中结果缓存 {cache.path(key)}")
+    else:
+        # 创建模型并加载权重
+        model = load_inference_model(args.model_path, args.backend, args.num_threads, args.warmup, profiler)
+
+        # 准备数据
+        x = np.load(args.data_path)["x"]
+
+        # 运行推理（滑动窗口，逐epoch平均概率）
+        with profiler.phase("first predict"):
+            probabilities = predict_epochs(model, x, stride=args.stride)
+
+        # 低置信度epoch第二遍打分
+        low_confidence = low_confidence_epochs(probabilities, args.confidence_threshold)
+        if args.rescore_model_path is not None and len(low_confidence):
+            with profiler.phase("rescore"):
+                rescore_model = load_rescore_model(args.rescore_model_path, args.rescore_backend,
+                                                   args.num_threads, model)
+                probabilities = rescore_epochs(rescore_model, x, probabilities, low_confidence)
+        if cache is not None:
+            cache.put(key, probabilities, low_confidence)
+
+    print(f"\n{len(low_confidence)} / {len(probabilities)} 个epoch置信度低于 {args.confidence_threshold}")
+    if args.output is not None:
+        save_hypnogram(args.output, probabilities, low_confidence)
 
     # 处理预测结果
-    all_preds = []
-    for seq in predictions:
-        epoch_preds = np.argmax(seq, axis=-1)
-        all_preds.extend(epoch_preds.tolist())
+    all_preds = np.argmax(probabilities, axis=-1).tolist()
 
     # 睡眠阶段映射
-    stage_map = {0: "Wake", 1: "N1", 2: "N2", 3: "N3", 4: "REM"}
-    sleep_stages = [stage_map[p] for p in all_preds]
+    sleep_stages = [stage_names[p] for p in all_preds]
 
     print("\n睡眠阶段预测结果:")
     for i, stage in enumerate(sleep_stages[:]):  # 只打印前20个作为示例
         print(f"Epoch {i + 1}: {stage}")
 
     print(f"\n共预测了 {len(sleep_stages)} 个epoch")
+    print(f"总耗时 ({args.backend}): {time.perf_counter() - start_time:.2f} 秒")
+    if args.profile:
+        profiler.report()
 
 
 if __name__ == "__main__":
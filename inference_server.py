@@ -0,0 +1,172 @@
+import argparse
+import io
+import json
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+
+from infer import load_inference_model
+from sequence import make_windows, average_windows, epoch_probabilities, check_stride
+
+
+class MicroBatcher:
+    """将并发请求的窗口合并成微批次后统一推理
+
+    第一个窗口到达后最多等待 max_latency 秒，或凑满 max_batch_size 个窗口，
+    然后执行一次 predict，再把结果按请求拆分返回。
+    """
+
+    def __init__(self, model, max_batch_size=64, max_latency=0.02):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, windows):
+        """提交 (n, seq_length, samples) 窗口，返回 Future[(n, seq_length, n_classes)]"""
+        future = Future()
+        self.requests.put((windows, future))
+        return future
+
+    def _loop(self):
+        while True:
+            pending = [self.requests.get()]
+            n_windows = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_latency
+            while n_windows < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                n_windows += len(item[0])
+            self._run(pending)
+
+    def _run(self, pending):
+        try:
+            batch = np.concatenate([w for w, _ in pending])[..., np.newaxis]
+            probs = epoch_probabilities(self.model.predict(batch, verbose=0))
+        except Exception as e:
+            for _, future in pending:
+                future.set_exception(e)
+            return
+        offset = 0
+        for windows, future in pending:
+            future.set_result(probs[offset:offset + len(windows)])
+            offset += len(windows)
+
+
+def make_handler(batcher, seq_length=15):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/health":
+                self._send_json(200, {"status": "ok"})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/score":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                # 步长超出 1..seq_length 时窗口之间的epoch无法覆盖，返回400
+                stride = check_stride(int(parse_qs(url.query).get("stride", [seq_length])[0]), seq_length)
+                # 请求体为 np.save 序列化的 (n_epochs, samples) 数组：单个epoch或整夜均可
+                x = np.load(io.BytesIO(body), allow_pickle=False)
+                x = np.atleast_2d(x).astype(np.float32)
+                chunks, starts = make_windows(x, seq_length, stride)
+                futures = [batcher.submit(windows) for windows in chunks]
+                window_probs = np.concatenate([future.result() for future in futures])
+                probabilities = average_windows(window_probs, starts, len(x))
+            except Exception as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200, {
+                "stages": np.argmax(probabilities, axis=-1).tolist(),
+                "probabilities": probabilities.tolist(),
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return InferenceHandler
+
+
+def create_server(model, host="127.0.0.1", port=8765, max_batch_size=64, max_latency=0.02, seq_length=15):
+    batcher = MicroBatcher(model, max_batch_size, max_latency)
+    return ThreadingHTTPServer((host, port), make_handler(batcher, seq_length))
+
+
+class InferenceClient:
+    """本地推理服务的客户端"""
+
+    def __init__(self, url="http://127.0.0.1:8765", timeout=60):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def health(self):
+        with urllib.request.urlopen(self.url + "/health", timeout=self.timeout) as resp:
+            return json.loads(resp.read())
+
+    def score(self, x, stride=15):
+        """x 为单个epoch (samples,) 或多个epoch (n_epochs, samples)，返回 (stages, probabilities)"""
+        buf = io.BytesIO()
+        np.save(buf, np.asarray(x, dtype=np.float32))
+        request = urllib.request.Request(
+            f"{self.url}/score?stride={stride}", data=buf.getvalue(),
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+            result = json.loads(resp.read())
+        return np.array(result["stages"]), np.array(result["probabilities"], dtype=np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, default="model.h5",
+                        help="Path to saved model")
+    parser.add_argument("--backend", type=str, default="keras", choices=["keras", "tflite"])
+    parser.add_argument("--num_threads", type=int, default=None,
+                        help="Number of CPU threads for the TFLite interpreter")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max_batch_size", type=int, default=64,
+                        help="Maximum number of 15-epoch windows per micro-batch")
+    parser.add_argument("--max_latency_ms", type=float, default=20,
+                        help="Maximum time a request waits for other requests to join its batch")
+    args = parser.parse_args()
+
+    model = load_inference_model(args.model_path, args.backend, args.num_threads)
+    server = create_server(model, args.host, args.port, args.max_batch_size, args.max_latency_ms / 1000)
+    print(f"Serving {args.model_path} ({args.backend}) on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import numpy as np
+import tensorflow as tf
+
+
+class KerasPredictor:
+    """以固定输入签名的 tf.function 包装Keras模型，接口与 model.predict 一致
+
+    batch 维为 None，不同长度的夜晚只切分为不同数量的批次，不会触发重新追踪。
+    """
+
+    def __init__(self, model, batch_size=32):
+        self.model = model
+        self.batch_size = batch_size
+        self.input_shape = model.input_shape
+        self.output_shape = model.output_shape
+        self._predict = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32)]
+        )
+
+    def warmup(self):
+        """用一个全零批次完成图追踪"""
+        self._predict(np.zeros((1,) + tuple(self.input_shape[1:]), dtype=np.float32))
+
+    def predict(self, x, batch_size=None, verbose=0):
+        batch_size = batch_size or self.batch_size
+        outputs = [self._predict(np.asarray(x[i:i + batch_size], dtype=np.float32)).numpy()
+                   for i in range(0, len(x), batch_size)]
+        if not outputs:
+            return np.empty((0,) + tuple(self.output_shape[1:]), dtype=np.float32)
+        return np.concatenate(outputs)
@@ -1,79 +1,217 @@
+import json
+import os
+import re
+import h5py
 import tensorflow as tf
-from tensorflow.keras import backend as K
 import numpy as np
-def weighted_categorical_loss(weights):
-    weights = K.variable(weights)
 
-    def loss(y_true, y_pred):
-        y_pred /= K.sum(y_pred, axis=-1, keepdims=True)
-        y_pred = K.clip(y_pred, K.epsilon(), 1 - K.epsilon())
-        loss = y_true * K.log(y_pred) * weights
-        loss = -K.sum(loss, -1)
-        return loss
+from custom_layers import SqueezeExcite1D, WeightedCategoricalCrossentropy
 
-    return loss
 
+def cpu_supports_bf16():
+    """检查CPU是否支持bfloat16指令 (AVX512_BF16 / AMX_BF16)"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
 
-def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio):
+
+def time_pool(x, pool_size=4):
+    """沿时间轴(采样点)做最大池化
+
+    使用 channels_last + (1, pool_size) 写法，与原 channels_first + (pool_size, 1)
+    输出一致；CPU不支持 channels_first 的MaxPool，因此无论在哪种设备上构建都用
+    这种写法，GPU上训练保存的SavedModel也能在CPU上加载推理。
+    """
+    return tf.keras.layers.MaxPool2D(
+        pool_size=(1, pool_size), strides=(1, pool_size), padding='same', data_format='channels_last'
+    )(x)
+
+
+BASE_FILTERS = (32, 64, 128)
+
+
+def scale_filters(num_filters, width=1.0, divisor=8):
+    """按宽度系数缩放通道数，并取整到 divisor 的倍数（便于SIMD向量化）"""
+    return max(divisor, int(num_filters * width + divisor / 2) // divisor * divisor)
+
+
+def block_filters(model):
+    """从已构建的模型中读取各残差块的通道数"""
+    filters = {}
+    for layer in model.layers:
+        match = re.fullmatch(r'block(\d+)_conv2', layer.name)
+        if match:
+            filters[int(match.group(1))] = layer.filters
+    return tuple(filters[i] for i in sorted(filters)) or None
+
+
+def saved_block_filters(h5_path):
+    """从完整模型h5的 model_config 中读取各残差块的通道数；旧版文件返回 None"""
+    with h5py.File(h5_path, 'r') as f:
+        config = f.attrs.get('model_config')
+    if config is None:
+        return None
+    if isinstance(config, bytes):
+        config = config.decode()
+    filters = {}
+    for layer in json.loads(config)['config']['layers']:
+        match = re.fullmatch(r'block(\d+)_conv2', layer['config']['name'])
+        if match:
+            filters[int(match.group(1))] = layer['config']['filters']
+    return tuple(filters[i] for i in sorted(filters)) or None
+
+
+def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio, name=None):
+    """残差SE块；name 给出时各层以 {name}_conv1 等命名，剪枝时据此定位"""
+    layer_name = (lambda suffix: f'{name}_{suffix}') if name else (lambda suffix: None)
     x = tf.keras.layers.Conv1D(
         filters=num_filters, kernel_size=kernel_size, strides=strides,
-        padding='same', kernel_initializer='he_normal'
+        padding='same', kernel_initializer='he_normal', name=layer_name('conv1')
     )(inputs)
-    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.BatchNormalization(name=layer_name('bn1'))(x)
     x = tf.keras.layers.Activation('relu')(x)
     x = tf.keras.layers.Conv1D(
         filters=num_filters, kernel_size=kernel_size, strides=strides,
-        padding='same', kernel_initializer='he_normal'
+        padding='same', kernel_initializer='he_normal', name=layer_name('conv2')
     )(x)
-    x = tf.keras.layers.BatchNormalization()(x)
+    x = tf.keras.layers.BatchNormalization(name=layer_name('bn2'))(x)
 
-    se = tf.keras.layers.Lambda(lambda x: K.mean(x, axis=-2, keepdims=True))(x)
-    se = tf.keras.layers.Dense(units=num_filters // ratio)(se)
-    se = tf.keras.layers.Activation('relu')(se)
-    se = tf.keras.layers.Dense(units=num_filters)(se)
-    se = tf.keras.layers.Activation('sigmoid')(se)
-    x = tf.keras.layers.multiply([x, se])
+    x = SqueezeExcite1D(ratio=ratio, name=layer_name('se'))(x)
 
     x_skip = tf.keras.layers.Conv1D(
         filters=num_filters, kernel_size=1, strides=1,
-        padding='same', kernel_initializer='he_normal'
+        padding='same', kernel_initializer='he_normal', name=layer_name('skip_conv')
     )(inputs)
-    x_skip = tf.keras.layers.BatchNormalization()(x_skip)
+    x_skip = tf.keras.layers.BatchNormalization(name=layer_name('skip_bn'))(x_skip)
 
     x = tf.keras.layers.Add()([x, x_skip])
     x = tf.keras.layers.Activation('relu')(x)
     return x
 
 
-def create_model(Fs=100, n_classes=5, seq_length=15, summary=True):
-    x_input = tf.keras.Input(shape=(seq_length, 30 * Fs, 1))
-
-    x = resnet_se_block(x_input, 32, 3, 1, 4)
-    x = tf.keras.layers.MaxPool2D(
-        pool_size=(4, 1), strides=(4, 1), padding='same', data_format='channels_first' #cpu训练时改为 channels_last
-    )(x)
-
-    x = resnet_se_block(x, 64, 5, 1, 4)
-    x = tf.keras.layers.MaxPool2D(
-        pool_size=(4, 1), strides=(4, 1), padding='same', data_format='channels_first' #cpu训练时改为 channels_last
-    )(x)
-
-    x = resnet_se_block(x, 128, 7, 1, 4)
-    x = tf.keras.layers.Lambda(lambda x: K.mean(x, axis=-2, keepdims=False))(x)
-    x = tf.keras.layers.Dropout(rate=0.5)(x)
-
-    x = tf.keras.layers.LSTM(units=64, dropout=0.5, activation='relu', return_sequences=True)(x)
-    x_out = tf.keras.layers.Dense(units=n_classes, activation='softmax')(x)
+def create_model(Fs=100, n_classes=5, seq_length=15, summary=True,
+                 jit_compile=False, mixed_precision=False, stateful=False,
+                 width=1.0, filters=None):
+    """构建ResNet-SE-LSTM模型
+
+    jit_compile=True 时用XLA编译训练步；mixed_precision=True 且CPU支持
+    bfloat16时以 mixed_bfloat16 策略构建（输出层保持float32）。
+    stateful=True 时固定 batch=1，LSTM 在多次调用间保留状态（流式推理用）。
+    width 按比例缩放三个残差块的通道数 (32/64/128)；filters 直接指定各块
+    通道数（剪枝后的模型），优先于 width。
+    """
+    if filters is None:
+        filters = tuple(scale_filters(f, width) for f in BASE_FILTERS)
+    policy = tf.keras.mixed_precision.global_policy()
+    if mixed_precision:
+        if cpu_supports_bf16():
+            tf.keras.mixed_precision.set_global_policy('mixed_bfloat16')
+        else:
+            print("mixed_precision requested but the CPU has no bfloat16 support (AVX512_BF16/AMX_BF16); "
+                  "building the model in float32")
+
+    try:
+        x_input = tf.keras.Input(shape=(seq_length, 30 * Fs, 1), batch_size=1 if stateful else None)
+
+        x = resnet_se_block(x_input, filters[0], 3, 1, 4, name='block1')
+        x = time_pool(x)
+
+        x = resnet_se_block(x, filters[1], 5, 1, 4, name='block2')
+        x = time_pool(x)
+
+        x = resnet_se_block(x, filters[2], 7, 1, 4, name='block3')
+        x = tf.keras.layers.AveragePooling2D(pool_size=(1, x.shape[-2]))(x)
+        x = tf.keras.layers.Reshape((seq_length, x.shape[-1]))(x)
+        x = tf.keras.layers.Dropout(rate=0.5)(x)
+
+        x = tf.keras.layers.LSTM(units=64, dropout=0.5, activation='relu', return_sequences=True, stateful=stateful)(x)
+        x_out = tf.keras.layers.Dense(units=n_classes, activation='softmax', dtype='float32')(x)
+    finally:
+        tf.keras.mixed_precision.set_global_policy(policy)
 
     model = tf.keras.models.Model(x_input, x_out)
     model.compile(
         optimizer='adam',
-        loss=weighted_categorical_loss(np.array([1, 1.5, 1, 1, 1])),
-        metrics=['accuracy']
+        loss=WeightedCategoricalCrossentropy([1, 1.5, 1, 1, 1]),
+        metrics=['accuracy'],
+        jit_compile=jit_compile
     )
 
     if summary:
         model.summary()
         tf.keras.utils.plot_model(model, show_shapes=True, dpi=300, to_file='model.png')
 
-    return model
\ No newline at end of file
+    return model
+
+
+# 旧版h5中各层名称前缀与当前模型层类型的对应关系
+_legacy_layer_kinds = {
+    'Conv1D': 'conv1d',
+    'BatchNormalization': 'batch_normalization',
+    'Dense': 'dense',
+    'LSTM': 'lstm',
+}
+
+
+def load_legacy_weights(model, h5_path):
+    """将旧版 (Lambda + 独立Dense 的SE块) h5权重载入新模型
+
+    旧文件中每个SE块的两个Dense层在新结构里合并为一个 SqueezeExcite1D，
+    层数和层顺序都不同，load_weights 无法按拓扑匹配。这里按层类型分别
+    排队，同类层按原顺序依次对应，SqueezeExcite1D 依次取两个Dense层。
+    """
+    queues = {}
+    with h5py.File(h5_path, 'r') as f:
+        group = f['model_weights'] if 'model_weights' in f else f
+        for layer_name in group.attrs['layer_names']:
+            layer_group = group[layer_name]
+            weights = [np.asarray(layer_group[w]) for w in layer_group.attrs['weight_names']]
+            if weights:
+                kind = re.sub(r'_\d+$', '', layer_name.decode() if isinstance(layer_name, bytes) else layer_name)
+                queues.setdefault(kind, []).append(weights)
+
+    for layer in model.layers:
+        if not layer.weights:
+            continue
+        if isinstance(layer, SqueezeExcite1D):
+            weights = queues['dense'].pop(0) + queues['dense'].pop(0)
+        else:
+            weights = queues[_legacy_layer_kinds[type(layer).__name__]].pop(0)
+        for w, v in zip(weights, layer.weights):
+            if w.shape != tuple(v.shape):
+                raise ValueError(f"Weight shape mismatch for {v.name}: {w.shape} != {tuple(v.shape)}")
+        layer.set_weights(weights)
+
+    remaining = sum(len(q) for q in queues.values())
+    if remaining:
+        raise ValueError(f"{remaining} layers in {h5_path} were not loaded")
+    return model
+
+
+def build_model(model_path, seq_length=15):
+    """按检查点创建模型：SavedModel目录直接反序列化（已含权重），h5文件重建结构
+
+    剪枝或缩放宽度后的h5按其中记录的各块通道数重建结构。
+    """
+    if os.path.isdir(model_path):
+        return tf.keras.models.load_model(model_path, compile=False)
+    return create_model(seq_length=seq_length, summary=False, filters=saved_block_filters(model_path))
+
+
+def load_model_weights(model, model_path):
+    """将h5权重载入 build_model 创建的模型，旧版权重文件按层顺序载入；SavedModel无需处理"""
+    if os.path.isdir(model_path):
+        return model
+    try:
+        model.load_weights(model_path)
+    except ValueError:
+        load_legacy_weights(model, model_path)
+    return model
+
+
+def load_model(model_path, seq_length=15):
+    """加载模型：SavedModel目录直接反序列化，h5文件重建结构后载入权重"""
+    return load_model_weights(build_model(model_path, seq_length), model_path)
@@ -1,40 +1,25 @@
+import os
 import tensorflow as tf
 from tensorflow.keras import layers, Model
 import numpy as np
 
+from custom_layers import SqueezeExcite1D, FocalCategoricalLoss
+from model import BASE_FILTERS, scale_filters, saved_block_filters
 
-def focal_categorical_loss(alpha=[0.1, 0.3, 0.1, 0.2, 0.1], gamma=2.0):
-    """Focal Loss替代原加权损失函数，增强对少样本类别的处理能力"""
 
-    def loss(y_true, y_pred):
-        # 计算交叉熵
-        ce = -y_true * tf.math.log(tf.clip_by_value(y_pred, 1e-7, 1.0))
-
-        # 计算概率调制因子
-        p_t = tf.reduce_sum(y_true * y_pred, axis=-1)
-        modulating_factor = tf.pow(1.0 - p_t, gamma)
-
-        # 应用类别权重
-        alpha_factor = tf.reduce_sum(alpha * y_true, axis=-1)
-
-        # 组合Focal Loss
-        focal_loss = modulating_factor * alpha_factor * ce
-        return tf.reduce_mean(focal_loss, axis=-1)
-
-    return loss
-
-
-def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio=8):
-    """优化后的残差SE模块（适配地平线BPU）"""
+def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio=8, name=None):
+    """优化后的残差SE模块（适配地平线BPU）；name 的用法同 model.resnet_se_block"""
+    layer_name = (lambda suffix: f'{name}_{suffix}') if name else (lambda suffix: None)
     # 主路径
     x = layers.Conv1D(
         filters=num_filters,
         kernel_size=kernel_size,
         strides=strides,
         padding='same',
-        kernel_initializer='he_normal'
+        kernel_initializer='he_normal',
+        name=layer_name('conv1')
     )(inputs)
-    x = layers.BatchNormalization()(x)
+    x = layers.BatchNormalization(name=layer_name('bn1'))(x)
     x = layers.ReLU()(x)
 
     x = layers.Conv1D(
@@ -42,27 +27,18 @@ def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio=8):
         kernel_size=kernel_size,
         strides=strides,
         padding='same',
-        kernel_initializer='he_normal'
+        kernel_initializer='he_normal',
+        name=layer_name('conv2')
     )(x)
-    x = layers.BatchNormalization()(x)
+    x = layers.BatchNormalization(name=layer_name('bn2'))(x)
 
     # SE注意力模块（优化版）
-    se = layers.GlobalAveragePooling1D()(x)
-    se = layers.Reshape((1, num_filters))(se)  # 保持3D格式
-
-    se = layers.Dense(
-        units=num_filters // ratio,
-        activation='relu',
-        kernel_initializer='he_normal'
-    )(se)
-    se = layers.Dense(
-        units=num_filters,
+    x = SqueezeExcite1D(
+        ratio=ratio,
         activation='hard_sigmoid',  # 量化友好的激活函数
-        kernel_initializer='he_normal'
-    )(se)
-
-    # 应用注意力权重
-    x = layers.Multiply()([x, se])
+        kernel_initializer='he_normal',
+        name=layer_name('se')
+    )(x)
 
     # 快捷路径 (确保维度匹配)
     if strides > 1 or inputs.shape[-1] != num_filters:
@@ -71,9 +47,10 @@ def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio=8):
             kernel_size=1,
             strides=strides,
             padding='same',
-            kernel_initializer='he_normal'
+            kernel_initializer='he_normal',
+            name=layer_name('skip_conv')
         )(inputs)
-        x_skip = layers.BatchNormalization()(x_skip)
+        x_skip = layers.BatchNormalization(name=layer_name('skip_bn'))(x_skip)
     else:
         x_skip = inputs
 
@@ -82,21 +59,26 @@ def resnet_se_block(inputs, num_filters, kernel_size, strides, ratio=8):
     return layers.ReLU()(x)
 
 
-def create_optimized_model(Fs=100, n_classes=5, seq_length=15, summary=True):
-    """优化后的模型架构（保留LSTM，适配地平线RDK X3）"""
+def create_optimized_model(Fs=100, n_classes=5, seq_length=15, summary=True, width=1.0, filters=None):
+    """优化后的模型架构（保留LSTM，适配地平线RDK X3）
+
+    width / filters 的含义同 model.create_model。
+    """
+    if filters is None:
+        filters = tuple(scale_filters(f, width) for f in BASE_FILTERS)
     # 输入层（调整为NHWC格式）
     x_input = layers.Input(shape=(seq_length, Fs * 30, 1))
 
     # 第一残差块
-    x = resnet_se_block(x_input, 32, 3, 1, ratio=8)
-    x = layers.MaxPooling1D(pool_size=4, strides=4, padding='same')(x)
+    x = resnet_se_block(x_input, filters[0], 3, 1, ratio=8, name='block1')
+    x = layers.MaxPooling2D(pool_size=(1, 4), strides=(1, 4), padding='same')(x)  # 沿时间轴池化
 
     # 第二残差块
-    x = resnet_se_block(x, 64, 5, 1, ratio=8)
-    x = layers.MaxPooling1D(pool_size=4, strides=4, padding='same')(x)
+    x = resnet_se_block(x, filters[1], 5, 1, ratio=8, name='block2')
+    x = layers.MaxPooling2D(pool_size=(1, 4), strides=(1, 4), padding='same')(x)  # 沿时间轴池化
 
     # 第三残差块
-    x = resnet_se_block(x, 128, 7, 1, ratio=8)
+    x = resnet_se_block(x, filters[2], 7, 1, ratio=8, name='block3')
 
     # 调整维度并添加LSTM
     x = layers.Reshape((seq_length, -1))(x)  # 保持时间步维度
@@ -118,7 +100,7 @@ def create_optimized_model(Fs=100, n_classes=5, seq_length=15, summary=True):
     model = Model(inputs=x_input, outputs=x_out)
     model.compile(
         optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
-        loss=focal_categorical_loss(),
+        loss=FocalCategoricalLoss(axis=1),  # 类别位于输出的第1维
         metrics=['accuracy']
     )
 
@@ -135,5 +117,15 @@ def create_optimized_model(Fs=100, n_classes=5, seq_length=15, summary=True):
     return model
 
 
-# 创建模型实例
-model = create_optimized_model(summary=True)
\ No newline at end of file
+def load_optimized_model(model_path, seq_length=15):
+    """加载 create_optimized_model 的检查点：SavedModel目录直接反序列化，h5按记录的通道数重建后载入权重"""
+    if os.path.isdir(model_path):
+        return tf.keras.models.load_model(model_path, compile=False)
+    model = create_optimized_model(seq_length=seq_length, summary=False, filters=saved_block_filters(model_path))
+    model.load_weights(model_path)
+    return model
+
+
+if __name__ == "__main__":
+    # 仅在直接运行时构建模型并打印结构，导入本模块不会创建模型
+    create_optimized_model(summary=True)
\ No newline at end of file
@@ -1,8 +1,12 @@
 import argparse
 import glob
+import hashlib
+import json
+import logging as py_logging
+import multiprocessing
 import ntpath
 import os
-import shutil
+import traceback
 import numpy as np
 
 import pyedflib
@@ -22,6 +26,289 @@ ann2label = {
     "Movement time": 5
 }
 
+# Bump when the output format changes so existing NPZ files are regenerated
+PREPROCESS_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+# Epochs decoded per readSignal call (one hour of 30-s epochs)
+READ_CHUNK_EPOCHS = 120
+
+
+def file_fingerprint(path, chunk_size=1 << 20):
+    """Size, mtime and SHA-1 of a source file."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": h.hexdigest()}
+
+
+def source_unchanged(recorded, path):
+    """Compare a source file with its manifest entry.
+
+    Size and mtime decide in the common case; the file is only hashed when the
+    size matches but the mtime differs (e.g. the file was copied or touched).
+    """
+    if recorded is None or not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    if stat.st_size != recorded["size"]:
+        return False
+    if stat.st_mtime_ns == recorded["mtime_ns"]:
+        return True
+    if file_fingerprint(path)["sha1"] != recorded["sha1"]:
+        return False
+    recorded["mtime_ns"] = stat.st_mtime_ns
+    return True
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def save_npz_atomic(path, **arrays):
+    """Write to a temporary file first so an interrupted run never leaves a truncated NPZ."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def channel_dirname(ch_name):
+    """Per-channel output directory, e.g. "EEG Fpz-Cz" -> "eeg_fpz_cz"."""
+    return ch_name.lower().replace(" ", "_").replace("-", "_")
+
+
+def output_paths(output_dir, filename, select_ch, layout):
+    """NPZ files written for one record.
+
+    A single channel, or several channels stacked into one array, go to
+    output_dir/filename; the split layout writes one file per channel into
+    output_dir/<channel>/filename.
+    """
+    if len(select_ch) > 1 and layout == "split":
+        return [os.path.join(output_dir, channel_dirname(ch), filename) for ch in select_ch]
+    return [os.path.join(output_dir, filename)]
+
+
+def read_epochs(psg_f, ch_indices, n_epoch_samples, keep, chunk_epochs=READ_CHUNK_EPOCHS):
+    """Decode the kept epochs of the given channels into one float32 array.
+
+    The signals are read in blocks of chunk_epochs epochs spanning only the
+    first to the last kept epoch, and each block is copied straight into the
+    preallocated output, so the whole recording is never held as float64.
+    Returns (n_kept, n_epoch_samples) for one channel and
+    (n_kept, n_epoch_samples, channels) for several.
+    """
+    kept_idx = np.where(keep)[0]
+    shape = (len(kept_idx), n_epoch_samples) + ((len(ch_indices),) if len(ch_indices) > 1 else ())
+    x = np.empty(shape, dtype=np.float32)
+    if len(kept_idx) == 0:
+        return x
+    out = x if x.ndim == 3 else x[..., np.newaxis]
+    pos = 0
+    for block_start in range(kept_idx[0], kept_idx[-1] + 1, chunk_epochs):
+        block_end = min(block_start + chunk_epochs, kept_idx[-1] + 1)
+        block_keep = keep[block_start:block_end]
+        n_kept = np.count_nonzero(block_keep)
+        if n_kept == 0:
+            continue
+        for c, ch_idx in enumerate(ch_indices):
+            block = psg_f.readSignal(ch_idx, block_start * n_epoch_samples,
+                                     (block_end - block_start) * n_epoch_samples)
+            out[pos:pos + n_kept, :, c] = block.reshape(-1, n_epoch_samples)[block_keep]
+        pos += n_kept
+    return x
+
+
+def process_record(psg_fname, ann_fname, output_dir, select_ch, layout, w_edge_mins, logger):
+    """Extract the selected channels of a PSG/Hypnogram pair and save them as NPZ files.
+
+    All channels are read from one open EdfReader and share the label and
+    epoch selection. With several channels, x is stacked to
+    (epochs, samples, channels) or split into one NPZ per channel.
+    """
+    logger.info("Loading ...")
+    logger.info("Signal file: {}".format(psg_fname))
+    logger.info("Annotation file: {}".format(ann_fname))
+
+    psg_f = pyedflib.EdfReader(psg_fname)
+    ann_f = pyedflib.EdfReader(ann_fname)
+
+    assert psg_f.getStartdatetime() == ann_f.getStartdatetime()
+    start_datetime = psg_f.getStartdatetime()
+    logger.info("Start datetime: {}".format(str(start_datetime)))
+
+    file_duration = psg_f.getFileDuration()
+    logger.info("File duration: {} sec".format(file_duration))
+    epoch_duration = psg_f.datarecord_duration
+    if psg_f.datarecord_duration == 60: # Fix problems of SC4362F0-PSG.edf, SC4362FC-Hypnogram.edf
+        epoch_duration = epoch_duration / 2
+        logger.info("Epoch duration: {} sec (changed from 60 sec)".format(epoch_duration))
+    else:
+        logger.info("Epoch duration: {} sec".format(epoch_duration))
+
+    # Resolve the selected channels; their signals are read in one pass below
+    ch_names = psg_f.getSignalLabels()
+    ch_samples = psg_f.getNSamples()
+    ch_indices = []
+    sampling_rate = None
+    for ch in select_ch:
+        if ch not in ch_names:
+            raise Exception("Channel not found: {} (available: {})".format(ch, ch_names))
+        select_ch_idx = ch_names.index(ch)
+        ch_rate = psg_f.getSampleFrequency(select_ch_idx)
+        if sampling_rate is not None and ch_rate != sampling_rate:
+            # Epochs of all channels share one array; extract other rates in a separate run
+            raise Exception("Channel {} is sampled at {} Hz, expected {} Hz".format(ch, ch_rate, sampling_rate))
+        sampling_rate = ch_rate
+        ch_indices.append(select_ch_idx)
+        logger.info("Select channel: {}".format(ch))
+        logger.info("Select channel samples: {}".format(ch_samples[select_ch_idx]))
+        logger.info("Sample rate: {}".format(sampling_rate))
+    n_epoch_samples = int(epoch_duration * sampling_rate)
+
+    # Sanity check
+    n_epochs = psg_f.datarecords_in_file
+    if psg_f.datarecord_duration == 60: # Fix problems of SC4362F0-PSG.edf, SC4362FC-Hypnogram.edf
+        n_epochs = n_epochs * 2
+    for ch_idx in ch_indices:
+        assert ch_samples[ch_idx] == n_epochs * n_epoch_samples, \
+            f"signal: {ch_samples[ch_idx]} samples != {n_epochs} x {n_epoch_samples}"
+    signal_shape = (n_epochs, n_epoch_samples) + ((len(ch_indices),) if len(ch_indices) > 1 else ())
+
+    # Generate labels from onset and duration annotation
+    ann_onsets, ann_durations, ann_stages = ann_f.readAnnotations()
+    ann_f.close()
+    onset_sec = ann_onsets.astype(np.int64)
+    duration_sec = ann_durations.astype(np.int64)
+    ann_strs = ["".join(stage) for stage in ann_stages]
+    label_values = np.asarray([ann2label[ann_str] for ann_str in ann_strs], dtype=np.int32)
+    # Per-annotation lines are only formatted when debug logging is enabled
+    if logger.isEnabledFor(py_logging.DEBUG):
+        for a in range(len(ann_strs)):
+            logger.debug("Include onset:%s, duration:%s, label:%s (%s)",
+                         onset_sec[a], duration_sec[a], label_values[a], ann_strs[a])
+
+    # Sanity check: annotations are contiguous and cover whole epochs
+    expected_onset = np.concatenate([[0], np.cumsum(duration_sec)[:-1]])
+    assert np.array_equal(onset_sec, expected_onset), \
+        f"annotation onset {onset_sec[onset_sec != expected_onset][0]} is not contiguous"
+    partial = duration_sec % epoch_duration != 0
+    if partial.any():
+        logger.info(f"Something wrong: {duration_sec[partial][0]} {epoch_duration}")
+        raise Exception(f"Something wrong: {duration_sec[partial][0]} {epoch_duration}")
+
+    # Generate sleep stage labels
+    duration_epoch = (duration_sec // epoch_duration).astype(np.int64)
+    labels = np.repeat(label_values, duration_epoch)
+
+    # Remove annotations that are longer than the recorded signals
+    y = labels[:n_epochs]
+
+    # Select only sleep periods and drop movement and unknown epochs with one mask
+    nw_idx = np.where(y != stage_dict["W"])[0]
+    start_idx = max(nw_idx[0] - (w_edge_mins * 2), 0)
+    end_idx = min(nw_idx[-1] + (w_edge_mins * 2), len(y) - 1)
+    irrelevant = (y == stage_dict["MOVE"]) | (y == stage_dict["UNK"])
+    keep = np.zeros(n_epochs, dtype=bool)
+    keep[start_idx:end_idx + 1] = True
+    keep[:len(y)] &= ~irrelevant
+    logger.info("Data before selection: {}, {}".format(signal_shape, y.shape))
+    logger.info("Sleep period: epochs {} to {}".format(start_idx, end_idx))
+    n_move = np.count_nonzero(y[start_idx:end_idx + 1] == stage_dict["MOVE"])
+    n_unk = np.count_nonzero(y[start_idx:end_idx + 1] == stage_dict["UNK"])
+    if n_move > 0 or n_unk > 0:
+        logger.info("Remove irrelavant stages: Movement ({}), Unknown ({})".format(n_move, n_unk))
+
+    # Get epochs and their corresponding labels; only the kept epochs are decoded
+    x = read_epochs(psg_f, ch_indices, n_epoch_samples, keep)
+    psg_f.close()
+    y = y[keep[:len(y)]]
+    logger.info("Data after selection: {}, {}".format(x.shape, y.shape))
+
+    # Save
+    filename = ntpath.basename(psg_fname).replace("-PSG.edf", ".npz")
+    save_dict = {
+        "x": x,
+        "y": y,
+        "fs": sampling_rate,
+        "ch_label": select_ch[0] if len(select_ch) == 1 else np.asarray(select_ch),
+        "start_datetime": start_datetime,
+        "file_duration": file_duration,
+        "epoch_duration": epoch_duration,
+        "n_all_epochs": n_epochs,
+        "n_epochs": len(x),
+    }
+    paths = output_paths(output_dir, filename, select_ch, layout)
+    if len(paths) == 1:
+        save_npz_atomic(paths[0], **save_dict)
+    else:
+        for c, (ch, path) in enumerate(zip(select_ch, paths)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_npz_atomic(path, **dict(save_dict, x=x[..., c], ch_label=ch))
+
+    logger.info("\n=======================================\n")
+
+    return filename
+
+
+def process_task(task, logger):
+    """Process one record and return its output filename with the fingerprints of its sources."""
+    psg_fname, ann_fname = task[:2]
+    filename = process_record(*task, logger)
+    return filename, {"psg": file_fingerprint(psg_fname), "ann": file_fingerprint(ann_fname)}
+
+
+class _BufferHandler(py_logging.Handler):
+    """Collect log records so they can be sent back to the parent process."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Format the message now: the args may not be picklable
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+_worker_logger = None
+
+
+def _init_worker(level):
+    global _worker_logger
+    _worker_logger = py_logging.getLogger(f"preprocess_worker_{os.getpid()}")
+    _worker_logger.setLevel(level)
+    _worker_logger.propagate = False
+
+
+def _process_task(task):
+    handler = _BufferHandler()
+    _worker_logger.addHandler(handler)
+    try:
+        result = process_task(task, _worker_logger)
+        error = None
+    except Exception:
+        result = None
+        error = f"Failed to process {task[0]}:\n{traceback.format_exc()}"
+    finally:
+        _worker_logger.removeHandler(handler)
+    return result, handler.records, error
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -29,25 +316,30 @@ def main():
                         help="File path to the Sleep-EDF dataset.")
     parser.add_argument("--output_dir", type=str, default="E:/DREAMT base/sleep-edf/sleep-edf-database-expanded-1.0.0/sleep-cassette/eeg_fpz_cz",
                         help="Directory where to save outputs.")
-    parser.add_argument("--select_ch", type=str, default="EEG Fpz-Cz",
-                        help="Name of the channel in the dataset.")
+    parser.add_argument("--select_ch", type=str, nargs="+", default=["EEG Fpz-Cz"],
+                        help="Name of the channel(s) in the dataset; all are read in one pass over each file.")
+    parser.add_argument("--layout", type=str, default="stack", choices=["stack", "split"],
+                        help="With several channels: stack them into x of shape (epochs, samples, channels), "
+                             "or split them into one NPZ per channel under output_dir/<channel>/.")
     parser.add_argument("--log_file", type=str, default="info_ch_extract.log",
                         help="Log file.")
+    parser.add_argument("--w_edge_mins", type=int, default=30,
+                        help="Minutes of wake kept before the first and after the last sleep epoch.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of records processed in parallel.")
+    parser.add_argument("--force", action="store_true",
+                        help="Regenerate every record even if its sources and parameters are unchanged.")
     args = parser.parse_args()
 
-    # Output dir
-    if not os.path.exists(args.output_dir):
-        os.makedirs(args.output_dir)
-    else:
-        shutil.rmtree(args.output_dir)
-        os.makedirs(args.output_dir)
+    # Output dir: existing outputs are kept and only stale records are regenerated
+    os.makedirs(args.output_dir, exist_ok=True)
 
     args.log_file = os.path.join(args.output_dir, args.log_file)
 
     # Create logger
     logger = get_logger(args.log_file, level="info")
 
-    # Select channel
+    # Select channels
     select_ch = args.select_ch
 
     # Read raw and annotation from EDF files
@@ -58,135 +350,66 @@ def main():
     psg_fnames = np.asarray(psg_fnames)
     ann_fnames = np.asarray(ann_fnames)
 
+    # Parameters that change the content of every output file
+    params = json.loads(json.dumps({
+        "version": PREPROCESS_VERSION,
+        "select_ch": select_ch,
+        "layout": args.layout if len(select_ch) > 1 else None,
+        "w_edge_mins": args.w_edge_mins,
+        "ann2label": ann2label,
+    }))
+    manifest = load_manifest(args.output_dir)
+    records = manifest.get("records", {})
+
+    tasks = []
     for i in range(len(psg_fnames)):
-
-        logger.info("Loading ...")
-        logger.info("Signal file: {}".format(psg_fnames[i]))
-        logger.info("Annotation file: {}".format(ann_fnames[i]))
-
-        psg_f = pyedflib.EdfReader(psg_fnames[i])
-        ann_f = pyedflib.EdfReader(ann_fnames[i])
-
-        assert psg_f.getStartdatetime() == ann_f.getStartdatetime()
-        start_datetime = psg_f.getStartdatetime()
-        logger.info("Start datetime: {}".format(str(start_datetime)))
-
-        file_duration = psg_f.getFileDuration()
-        logger.info("File duration: {} sec".format(file_duration))
-        epoch_duration = psg_f.datarecord_duration
-        if psg_f.datarecord_duration == 60: # Fix problems of SC4362F0-PSG.edf, SC4362FC-Hypnogram.edf
-            epoch_duration = epoch_duration / 2
-            logger.info("Epoch duration: {} sec (changed from 60 sec)".format(epoch_duration))
-        else:
-            logger.info("Epoch duration: {} sec".format(epoch_duration))
-
-        # Extract signal from the selected channel
-        ch_names = psg_f.getSignalLabels()
-        ch_samples = psg_f.getNSamples()
-        select_ch_idx = -1
-        for s in range(psg_f.signals_in_file):
-            if ch_names[s] == select_ch:
-                select_ch_idx = s
-                break
-        if select_ch_idx == -1:
-            raise Exception("Channel not found.")
-        sampling_rate = psg_f.getSampleFrequency(select_ch_idx)
-        n_epoch_samples = int(epoch_duration * sampling_rate)
-        signals = psg_f.readSignal(select_ch_idx).reshape(-1, n_epoch_samples)
-        logger.info("Select channel: {}".format(select_ch))
-        logger.info("Select channel samples: {}".format(ch_samples[select_ch_idx]))
-        logger.info("Sample rate: {}".format(sampling_rate))
-
-        # Sanity check
-        n_epochs = psg_f.datarecords_in_file
-        if psg_f.datarecord_duration == 60: # Fix problems of SC4362F0-PSG.edf, SC4362FC-Hypnogram.edf
-            n_epochs = n_epochs * 2
-        assert len(signals) == n_epochs, f"signal: {signals.shape} != {n_epochs}"
-
-        # Generate labels from onset and duration annotation
-        labels = []
-        total_duration = 0
-        ann_onsets, ann_durations, ann_stages = ann_f.readAnnotations()
-        for a in range(len(ann_stages)):
-            onset_sec = int(ann_onsets[a])
-            duration_sec = int(ann_durations[a])
-            ann_str = "".join(ann_stages[a])
-
-            # Sanity check
-            assert onset_sec == total_duration
-
-            # Get label value
-            label = ann2label[ann_str]
-
-            # Compute # of epoch for this stage
-            if duration_sec % epoch_duration != 0:
-                logger.info(f"Something wrong: {duration_sec} {epoch_duration}")
-                raise Exception(f"Something wrong: {duration_sec} {epoch_duration}")
-            duration_epoch = int(duration_sec / epoch_duration)
-
-            # Generate sleep stage labels
-            label_epoch = np.ones(duration_epoch, dtype=np.int32) * label
-            labels.append(label_epoch)
-
-            total_duration += duration_sec
-
-            logger.info("Include onset:{}, duration:{}, label:{} ({})".format(
-                onset_sec, duration_sec, label, ann_str
-            ))
-        labels = np.hstack(labels)
-
-        # Remove annotations that are longer than the recorded signals
-        labels = labels[:len(signals)]
-
-        # Get epochs and their corresponding labels
-        x = signals.astype(np.float32)
-        y = labels.astype(np.int32)
-
-        # Select only sleep periods
-        w_edge_mins = 30
-        nw_idx = np.where(y != stage_dict["W"])[0]
-        start_idx = nw_idx[0] - (w_edge_mins * 2)
-        end_idx = nw_idx[-1] + (w_edge_mins * 2)
-        if start_idx < 0: start_idx = 0
-        if end_idx >= len(y): end_idx = len(y) - 1
-        select_idx = np.arange(start_idx, end_idx+1)
-        logger.info("Data before selection: {}, {}".format(x.shape, y.shape))
-        x = x[select_idx]
-        y = y[select_idx]
-        logger.info("Data after selection: {}, {}".format(x.shape, y.shape))
-
-        # Remove movement and unknown
-        move_idx = np.where(y == stage_dict["MOVE"])[0]
-        unk_idx = np.where(y == stage_dict["UNK"])[0]
-        if len(move_idx) > 0 or len(unk_idx) > 0:
-            remove_idx = np.union1d(move_idx, unk_idx)
-            logger.info("Remove irrelavant stages")
-            logger.info("  Movement: ({}) {}".format(len(move_idx), move_idx))
-            logger.info("  Unknown: ({}) {}".format(len(unk_idx), unk_idx))
-            logger.info("  Remove: ({}) {}".format(len(remove_idx), remove_idx))
-            logger.info("  Data before removal: {}, {}".format(x.shape, y.shape))
-            select_idx = np.setdiff1d(np.arange(len(x)), remove_idx)
-            x = x[select_idx]
-            y = y[select_idx]
-            logger.info("  Data after removal: {}, {}".format(x.shape, y.shape))
-
-        # Save
         filename = ntpath.basename(psg_fnames[i]).replace("-PSG.edf", ".npz")
-        save_dict = {
-            "x": x,
-            "y": y,
-            "fs": sampling_rate,
-            "ch_label": select_ch,
-            "start_datetime": start_datetime,
-            "file_duration": file_duration,
-            "epoch_duration": epoch_duration,
-            "n_all_epochs": n_epochs,
-            "n_epochs": len(x),
-        }
-        np.savez(os.path.join(args.output_dir, filename), **save_dict)
-
-        logger.info("\n=======================================\n")
-
+        entry = records.get(filename)
+        if (not args.force and entry is not None and entry["params"] == params
+                and all(os.path.exists(path) for path in output_paths(args.output_dir, filename, select_ch, args.layout))
+                and source_unchanged(entry["psg"], psg_fnames[i])
+                and source_unchanged(entry["ann"], ann_fnames[i])):
+            continue
+        tasks.append((psg_fnames[i], ann_fnames[i], args.output_dir, select_ch, args.layout, args.w_edge_mins))
+
+    # Drop outputs whose source recordings were removed
+    current = {ntpath.basename(f).replace("-PSG.edf", ".npz") for f in psg_fnames}
+    for filename in sorted(set(records) - current):
+        logger.info("Remove stale output: {}".format(filename))
+        for output in records[filename].get("outputs", [filename]):
+            if os.path.exists(os.path.join(args.output_dir, output)):
+                os.remove(os.path.join(args.output_dir, output))
+        del records[filename]
+    save_manifest(args.output_dir, {"records": records})
+
+    logger.info("{} records, {} unchanged, {} to process".format(
+        len(psg_fnames), len(psg_fnames) - len(tasks), len(tasks)))
+
+    def record_done(result):
+        filename, sources = result
+        outputs = [os.path.relpath(path, args.output_dir)
+                   for path in output_paths(args.output_dir, filename, select_ch, args.layout)]
+        records[filename] = dict(sources, params=params, outputs=outputs)
+        # Save after every record so an interrupted run keeps its progress
+        save_manifest(args.output_dir, {"records": records})
+
+    if args.workers <= 1:
+        for task in tasks:
+            record_done(process_task(task, logger))
+        save_manifest(args.output_dir, {"records": records})
+        return
+
+    # Records are independent: process them in a pool. Each worker logs into a
+    # per-record buffer, and the parent replays the buffers in record order so
+    # the merged log is the same as a sequential run.
+    with multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(logger.level,)) as pool:
+        for result, log_records, error in pool.imap(_process_task, tasks):
+            for record in log_records:
+                logger.handle(record)
+            if error is not None:
+                raise RuntimeError(error)
+            record_done(result)
+    save_manifest(args.output_dir, {"records": records})
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,178 @@
+import argparse
+import os
+from glob import glob
+import numpy as np
+import tensorflow as tf
+
+from custom_layers import WeightedCategoricalCrossentropy, FocalCategoricalLoss
+from model import create_model, load_model, block_filters, scale_filters
+
+
+def filter_norms(kernel):
+    """Conv1D 卷积核 (kernel_size, in, out) 每个输出通道的L1范数"""
+    return np.abs(kernel).sum(axis=(0, 1))
+
+
+def top_filters(scores, keep):
+    """按得分保留 keep 个通道，返回升序索引（保持原通道顺序）"""
+    return np.sort(np.argsort(-scores, kind='stable')[:keep])
+
+
+def _layer(model, name):
+    try:
+        return model.get_layer(name)
+    except ValueError:
+        return None
+
+
+def select_filters(model, sparsity, divisor=8):
+    """按权重幅值为每个残差块选择保留的通道
+
+    块内第一层卷积的输出通道按自身卷积核L1范数排序；块输出通道经 Add 由
+    主路径第二层卷积与快捷路径卷积共同决定，按两者L1范数之和排序。
+    保留数取整到 divisor 的倍数。返回 [(inner_idx, out_idx), ...]。
+    """
+    selection = []
+    for i in range(1, len(block_filters(model)) + 1):
+        conv1 = model.get_layer(f'block{i}_conv1')
+        conv2 = model.get_layer(f'block{i}_conv2')
+        skip = _layer(model, f'block{i}_skip_conv')
+        keep = min(conv1.filters, scale_filters(conv1.filters, 1 - sparsity, divisor))
+        out_scores = filter_norms(conv2.kernel.numpy())
+        if skip is not None:
+            out_scores = out_scores + filter_norms(skip.kernel.numpy())
+        selection.append((top_filters(filter_norms(conv1.kernel.numpy()), keep), top_filters(out_scores, keep)))
+    return selection
+
+
+def _copy_block(src, dst, i, in_idx, inner, out):
+    """将第 i 个残差块按所选通道切片后复制到剪枝模型"""
+    prefix = f'block{i}'
+    kernel, bias = src.get_layer(f'{prefix}_conv1').get_weights()
+    dst.get_layer(f'{prefix}_conv1').set_weights([kernel[:, in_idx][:, :, inner], bias[inner]])
+    dst.get_layer(f'{prefix}_bn1').set_weights([w[inner] for w in src.get_layer(f'{prefix}_bn1').get_weights()])
+
+    kernel, bias = src.get_layer(f'{prefix}_conv2').get_weights()
+    dst.get_layer(f'{prefix}_conv2').set_weights([kernel[:, inner][:, :, out], bias[out]])
+    dst.get_layer(f'{prefix}_bn2').set_weights([w[out] for w in src.get_layer(f'{prefix}_bn2').get_weights()])
+
+    # SE 的压缩层同样按幅值保留 通道数 / ratio 个单元
+    sq_kernel, sq_bias, ex_kernel, ex_bias = src.get_layer(f'{prefix}_se').get_weights()
+    se = dst.get_layer(f'{prefix}_se')
+    units = top_filters(np.abs(sq_kernel[out]).sum(axis=0), se.squeeze_dense.units)
+    se.set_weights([sq_kernel[out][:, units], sq_bias[units], ex_kernel[units][:, out], ex_bias[out]])
+
+    src_skip, dst_skip = _layer(src, f'{prefix}_skip_conv'), _layer(dst, f'{prefix}_skip_conv')
+    if (src_skip is None) != (dst_skip is None):
+        raise ValueError(f"{prefix}: pruning changed whether the block has a shortcut convolution")
+    if src_skip is not None:
+        kernel, bias = src_skip.get_weights()
+        dst_skip.set_weights([kernel[:, in_idx][:, :, out], bias[out]])
+        dst.get_layer(f'{prefix}_skip_bn').set_weights(
+            [w[out] for w in src.get_layer(f'{prefix}_skip_bn').get_weights()])
+
+
+def prune_model(model, sparsity, arch='model', divisor=8):
+    """幅值结构化剪枝：去掉各残差块中L1范数最小的通道，返回新的（更窄的）模型
+
+    剪枝后的模型用相同的构建函数以新的各块通道数重建，保留通道的权重原样复制；
+    LSTM 输入按最后一个块保留的通道切片，其余层权重不变。
+    """
+    if arch == 'lite':
+        from model_lite import create_optimized_model as builder
+    else:
+        builder = create_model
+    selection = select_filters(model, sparsity, divisor)
+    pruned = builder(seq_length=model.input_shape[1], summary=False,
+                     filters=tuple(len(out) for _, out in selection))
+
+    in_idx = np.arange(model.input_shape[-1])
+    for i, (inner, out) in enumerate(selection, start=1):
+        _copy_block(model, pruned, i, in_idx, inner, out)
+        in_idx = out
+
+    # 块以外带权重的层按顺序一一对应；第一个（LSTM）的输入维需要切片
+    src_layers = [l for l in model.layers if l.weights and not l.name.startswith('block')]
+    dst_layers = [l for l in pruned.layers if l.weights and not l.name.startswith('block')]
+    n_channels = len(model.get_layer(f'block{len(selection)}_conv2').get_weights()[1])
+    for k, (src, dst) in enumerate(zip(src_layers, dst_layers)):
+        weights = src.get_weights()
+        if k == 0:
+            # create_optimized_model 将 (时间, 通道) 展平后送入LSTM，输入按 t * C + c 排列
+            n_steps = weights[0].shape[0] // n_channels
+            rows = (np.arange(n_steps)[:, np.newaxis] * n_channels + in_idx).reshape(-1)
+            weights[0] = weights[0][rows]
+        dst.set_weights(weights)
+    return pruned
+
+
+def sequence_output(model):
+    """create_optimized_model 输出 (n, n_classes, seq_length, 1)，训练时转换为 (n, seq_length, n_classes)
+
+    返回的模型与原模型共享权重；create_model 的输出已是该形状，直接返回。
+    """
+    if len(model.output_shape) == 3:
+        return model
+    x = tf.keras.layers.Permute((2, 1, 3))(model.output)
+    x = tf.keras.layers.Reshape(model.output_shape[2:3] + model.output_shape[1:2])(x)
+    return tf.keras.Model(model.input, x)
+
+
+def fine_tune(model, arch, train_data, val_data, epochs=10, batch_size=16, learning_rate=1e-4):
+    """以较小学习率微调剪枝后的模型，恢复精度"""
+    trainable = sequence_output(model)
+    loss = FocalCategoricalLoss() if arch == 'lite' else WeightedCategoricalCrossentropy([1, 1.5, 1, 1, 1])
+    trainable.compile(optimizer=tf.keras.optimizers.Adam(learning_rate), loss=loss, metrics=['accuracy'])
+    early = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)
+    return trainable.fit(*train_data, validation_data=val_data, epochs=epochs,
+                         batch_size=batch_size, callbacks=[early], verbose=2)
+
+
+def main():
+    from train import load_sequences, split_records
+    from split import resolve_data_path, DEFAULT_DATA_PATH
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, default="model.h5",
+                        help="Trained checkpoint to prune.")
+    parser.add_argument("--arch", type=str, default="model", choices=["model", "lite"],
+                        help="Architecture of the checkpoint: create_model or create_optimized_model.")
+    parser.add_argument("--sparsity", type=float, default=0.5,
+                        help="Fraction of filters removed from every residual block.")
+    parser.add_argument("--data_path", type=str, default=None,
+                        help="Directory of preprocessed NPZ files used for fine-tuning "
+                             f"(default: the split manifest's data_path, else {DEFAULT_DATA_PATH}).")
+    parser.add_argument("--split_manifest", type=str, default=None,
+                        help="Fine-tune on the fold's training records (see split.py).")
+    parser.add_argument("--fold", type=int, default=0)
+    parser.add_argument("--seq_length", type=int, default=15)
+    parser.add_argument("--epochs", type=int, default=10,
+                        help="Fine-tuning epochs after pruning (0: prune only).")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--learning_rate", type=float, default=1e-4)
+    parser.add_argument("--output", type=str, default="model_pruned.h5")
+    args = parser.parse_args()
+
+    if args.arch == 'lite':
+        from model_lite import load_optimized_model
+        model = load_optimized_model(args.model_path, args.seq_length)
+    else:
+        model = load_model(args.model_path, args.seq_length)
+
+    pruned = prune_model(model, args.sparsity, args.arch)
+    print(f"filters {block_filters(model)} -> {block_filters(pruned)}, "
+          f"params {model.count_params()} -> {pruned.count_params()}")
+
+    if args.epochs > 0:
+        fnames = sorted(glob(os.path.join(resolve_data_path(args), '*.npz')))
+        fnames_train, fnames_val, _ = split_records(fnames, args)
+        fine_tune(pruned, args.arch,
+                  load_sequences(fnames_train, args.seq_length), load_sequences(fnames_val, args.seq_length),
+                  args.epochs, args.batch_size, args.learning_rate)
+
+    pruned.save(args.output)
+    print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+
+from sequence_cache import hash_files
+from hypnogram_io import save_hypnogram, load_hypnogram
+
+
+def hash_path(path):
+    """按内容计算检查点或输入文件的哈希；目录（SavedModel）按其中全部文件计算"""
+    if os.path.isdir(path):
+        fnames = sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+        return hash_files(fnames)
+    return hash_files([path])
+
+
+def cache_key(model_hash, input_hash, params):
+    """(模型权重哈希, 输入数据哈希, 推理参数) 的内容地址"""
+    payload = json.dumps({"model": model_hash, "input": input_hash, "params": params}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class HypnogramCache:
+    """按内容寻址的睡眠分期结果缓存，超过容量时按最近最少使用淘汰
+
+    每个结果是 hypnogram_io.save_hypnogram 格式的NPZ；读取时刷新文件的
+    修改时间，淘汰时从最久未使用的文件开始删除，直到总大小不超过 max_bytes。
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        """命中时返回 {stages, probabilities, low_confidence}，否则返回 None"""
+        path = self.path(key)
+        try:
+            result = load_hypnogram(path)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        os.utime(path)
+        return result
+
+    def put(self, key, probabilities, low_confidence=None):
+        save_hypnogram(self.path(key), probabilities, low_confidence)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,103 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def one_hot(y, n_classes=5):
+    """将整数睡眠阶段标签编码为one-hot矩阵"""
+    y = np.asarray(y)
+    return np.eye(n_classes, dtype=np.float32)[y]
+
+
+def make_sequences(x, seq_length=15, stride=None):
+    """将逐epoch数据按窗口切分为序列
+
+    返回形状为 (n_seq, seq_length, ...) 的数组。窗口通过
+    sliding_window_view 构造，是原数组的只读视图而非拷贝；
+    stride 默认等于 seq_length（不重叠），末尾不足一个窗口的epoch被丢弃。
+    """
+    if stride is None:
+        stride = seq_length
+    x = np.asarray(x)
+    if len(x) < seq_length:
+        return np.empty((0, seq_length) + x.shape[1:], dtype=x.dtype)
+    windows = sliding_window_view(x, seq_length, axis=0)[::stride]
+    # sliding_window_view 将窗口维放在最后，移回到第1维
+    return np.moveaxis(windows, -1, 1)
+
+
+def make_record_sequences(x, y, seq_length=15, n_classes=5):
+    """对单条记录同时切分信号序列和one-hot标签序列"""
+    return make_sequences(x, seq_length), make_sequences(one_hot(y, n_classes), seq_length)
+
+
+def epoch_probabilities(pred):
+    """将模型输出统一为 (n_seq, seq_length, n_classes)
+
+    create_model 输出 (n_seq, seq_length, n_classes)；create_optimized_model
+    为满足BPU约束输出 (n_seq, n_classes, seq_length, 1)，这里转换回来。
+    """
+    pred = np.asarray(pred)
+    if pred.ndim == 4:
+        pred = np.transpose(pred[..., 0], (0, 2, 1))
+    return pred
+
+
+def check_stride(stride, seq_length=15):
+    """步长须在 1..seq_length 之间，否则窗口之间的epoch不会被任何窗口覆盖"""
+    if not 1 <= stride <= seq_length:
+        raise ValueError(f"stride must be between 1 and {seq_length}, got {stride}")
+    return stride
+
+
+def window_starts(n_epochs, seq_length=15, stride=None):
+    """滑动窗口的起始位置；最后补一个与末尾对齐的窗口，保证每个epoch都被覆盖"""
+    if stride is None:
+        stride = seq_length
+    check_stride(stride, seq_length)
+    last = max(n_epochs - seq_length, 0)
+    starts = np.arange(0, last + 1, stride)
+    if starts[-1] != last:
+        starts = np.append(starts, last)
+    return starts
+
+
+def make_windows(x, seq_length=15, stride=None):
+    """按步长 stride 切分可重叠的窗口，不丢弃末尾epoch
+
+    返回 (chunks, starts)：chunks 是窗口数组的列表，依次对应 starts。第一块是
+    sliding_window_view 的视图；末尾不与步长对齐时，末尾对齐窗口单独作为只含
+    一个窗口的第二块（同样是视图），避免为拼接而拷贝全部窗口。记录短于一个
+    窗口时在末尾补零。
+    """
+    x = np.asarray(x)
+    n_epochs = len(x)
+    if n_epochs < seq_length:
+        pad = np.zeros((seq_length - n_epochs,) + x.shape[1:], dtype=x.dtype)
+        x = np.concatenate([x, pad])
+    starts = window_starts(n_epochs, seq_length, stride)
+    chunks = [make_sequences(x, seq_length, stride)]
+    if len(chunks[0]) < len(starts):
+        chunks.append(make_sequences(x[starts[-1]:], seq_length))
+    return chunks, starts
+
+
+def average_windows(window_probs, starts, n_epochs, allow_uncovered=False):
+    """将各窗口的逐epoch概率按位置累加并取平均，得到 (n_epochs, n_classes)
+
+    默认要求每个epoch至少被一个窗口覆盖；allow_uncovered=True 时（只对部分
+    窗口重新推理）未覆盖的epoch返回 NaN。
+    """
+    window_probs = np.asarray(window_probs)
+    seq_length, n_classes = window_probs.shape[1:]
+    index = (starts[:, np.newaxis] + np.arange(seq_length)).reshape(-1)
+    probs = window_probs.reshape(-1, n_classes)
+    valid = index < n_epochs
+    sums = np.zeros((n_epochs, n_classes), dtype=np.float64)
+    counts = np.zeros(n_epochs, dtype=np.float64)
+    np.add.at(sums, index[valid], probs[valid])
+    np.add.at(counts, index[valid], 1)
+    if allow_uncovered:
+        counts[counts == 0] = np.nan
+    else:
+        assert n_epochs == 0 or counts.min() > 0, "some epochs are not covered by any window"
+    return (sums / counts[:, np.newaxis]).astype(np.float32)
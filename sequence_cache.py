@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+
+INDEX_FILE = 'index.json'
+X_FILE = 'x.npy'
+Y_FILE = 'y.npy'
+
+
+def hash_files(fnames, chunk_size=1 << 20):
+    """按内容计算一组源文件的联合哈希，用于判断缓存是否失效"""
+    h = hashlib.sha1()
+    for fname in fnames:
+        h.update(os.path.basename(fname).encode())
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def file_stat(fname):
+    """源文件的名称、大小与修改时间，用于快速判断缓存是否失效"""
+    stat = os.stat(fname)
+    return {'name': os.path.basename(fname), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def sources_unchanged(sources, fnames):
+    """比较当前源文件与索引中记录的源文件
+
+    名称、大小与修改时间都一致时直接视为未变化，不读取文件内容；只有大小相同
+    而修改时间不同（如被复制或 touch）的文件才计算哈希，内容一致时就地更新
+    记录的修改时间。返回 (是否未变化, 记录是否被更新)。
+    """
+    if sources is None or len(sources) != len(fnames):
+        return False, False
+    refreshed = False
+    for source, fname in zip(sources, fnames):
+        stat = file_stat(fname)
+        if stat['name'] != source['name'] or stat['size'] != source['size']:
+            return False, False
+        if stat['mtime_ns'] != source['mtime_ns']:
+            if hash_files([fname]) != source['sha1']:
+                return False, False
+            source['mtime_ns'] = stat['mtime_ns']
+            refreshed = True
+    return True, refreshed
+
+
+def write_index(cache_dir, index):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def compile_cache(fnames, cache_dir):
+    """将全部NPZ记录写入一个连续的 x.npy / y.npy，并生成记录索引
+
+    x.npy 通过 open_memmap 预分配后逐条记录写入，编译过程中
+    同一时刻只有一条记录驻留内存。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    # 先删除旧索引：编译中断时不会留下旧索引指向新写入的数组
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    # 第一遍只读取标签，确定每条记录的长度，并记录各源文件的大小、修改时间与哈希
+    lengths = []
+    sources = []
+    n_samples = None
+    for fname in fnames:
+        samples = np.load(fname)
+        lengths.append(len(samples['y']))
+        if n_samples is None:
+            n_samples = samples['x'].shape[1]
+        sources.append(dict(file_stat(fname), sha1=hash_files([fname])))
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    x_path = os.path.join(cache_dir, X_FILE)
+    y_path = os.path.join(cache_dir, Y_FILE)
+    x_out = np.lib.format.open_memmap(x_path, mode='w+', dtype=np.float32,
+                                      shape=(int(offsets[-1]), n_samples))
+    y_out = np.lib.format.open_memmap(y_path, mode='w+', dtype=np.int32,
+                                      shape=(int(offsets[-1]),))
+
+    records = []
+    for i, fname in enumerate(fnames):
+        samples = np.load(fname)
+        start, stop = int(offsets[i]), int(offsets[i + 1])
+        x_out[start:stop] = samples['x']
+        y_out[start:stop] = samples['y']
+        records.append({'name': os.path.basename(fname), 'start': start, 'stop': stop})
+    x_out.flush()
+    y_out.flush()
+    del x_out, y_out
+
+    # 索引最后写入，中途失败的编译不会被当作有效缓存
+    index = {'sources': sources, 'n_samples': n_samples, 'records': records}
+    write_index(cache_dir, index)
+    return index
+
+
+def open_cache(fnames, cache_dir):
+    """以只读内存映射方式打开序列缓存，源文件变化时自动重新编译
+
+    未变化的判断先比较大小与修改时间，只对修改时间变化的文件计算哈希，
+    重启训练时不需要重新读取整个数据集。
+    """
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+
+    index = None
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        unchanged, refreshed = sources_unchanged(index.get('sources'), fnames)
+        if not unchanged:
+            index = None
+        elif refreshed:
+            write_index(cache_dir, index)
+    if index is None:
+        index = compile_cache(fnames, cache_dir)
+
+    x = np.load(os.path.join(cache_dir, X_FILE), mmap_mode='r')
+    y = np.load(os.path.join(cache_dir, Y_FILE), mmap_mode='r')
+    return x, y, index['records']
+
+
+def sequence_starts(records, seq_length=15):
+    """计算每个完整序列在缓存数组中的起始位置（序列不跨记录）"""
+    starts = [np.arange(r['start'], r['stop'] - seq_length + 1, seq_length)
+              for r in records]
+    if not starts:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(starts).astype(np.int64)
+
+
+def get_sequence(x, y, start, seq_length=15):
+    """返回缓存中一个序列的零拷贝视图"""
+    return x[start:start + seq_length], y[start:start + seq_length]
@@ -25,4 +25,13 @@ class_dict = {
     REM: "REM",
     MOVE: "MOVE",
     UNK: "UNK",
-}
\ No newline at end of file
+}
+
+# Display names of the five scored stages
+stage_names = {
+    W: "Wake",
+    N1: "N1",
+    N2: "N2",
+    N3: "N3",
+    REM: "REM",
+}
@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import re
+from glob import glob
+import numpy as np
+
+
+DEFAULT_DATA_PATH = "E:/DREAMT base/sleep-edf/sleep-edf-database-expanded-1.0.0/sleep-cassette/eeg_fpz_cz"
+
+
+def parse_subject_night(filename):
+    """解析文件名获取受试者ID和夜晚编号
+
+    与 tool/npz2csv.parse_filename 的匹配规则一致；对 Sleep-EDF 的
+    SC4ssN / ST7ssN 命名，再将记录ID拆分为受试者 (SC4ss) 与夜晚 (N)。
+    """
+    base_name = os.path.basename(filename)
+
+    match = re.match(r"((?:SC4|ST7)\d{2})(\d)\w*\.npz", base_name)
+    if match:
+        return match.group(1), match.group(2)
+
+    patterns = [
+        r"([A-Z]{2}\d+)-(\w+)\..*",  # SC4*和ST7*模式
+        r"([A-Z]+-\d+)-(\w+)\..*",  # 带有连字符的ID模式
+        r"([A-Za-z]+[\d_]+)_?(\w+)\.npz"  # 更通用的模式
+    ]
+    for pattern in patterns:
+        match = re.match(pattern, base_name)
+        if match:
+            return match.group(1), match.group(2)
+
+    name_without_ext = os.path.splitext(base_name)[0]
+    parts = name_without_ext.split('_')
+    if len(parts) >= 2:
+        return parts[0], '_'.join(parts[1:])
+    return name_without_ext, "unknown"
+
+
+def make_subject_folds(fnames, n_folds=10, val_ratio=0.1, seed=42):
+    """按受试者划分k折，同一受试者的所有夜晚只会出现在同一个子集中"""
+    names = sorted(os.path.basename(f) for f in fnames)
+    subjects = {}
+    for name in names:
+        subject, _ = parse_subject_night(name)
+        subjects.setdefault(subject, []).append(name)
+
+    subject_ids = np.array(sorted(subjects))
+    if n_folds > len(subject_ids):
+        raise ValueError(f"n_folds ({n_folds}) > number of subjects ({len(subject_ids)})")
+    rng = np.random.default_rng(seed)
+    rng.shuffle(subject_ids)
+    test_groups = np.array_split(subject_ids, n_folds)
+
+    folds = []
+    for i, test_subjects in enumerate(test_groups):
+        test_set = set(test_subjects)
+        rest = np.array([s for s in subject_ids if s not in test_set])
+        n_val = max(1, int(round(len(rest) * val_ratio)))
+        val_subjects = rest[:n_val]
+        train_subjects = rest[n_val:]
+        folds.append({
+            "fold": i,
+            "train": sorted(n for s in train_subjects for n in subjects[s]),
+            "val": sorted(n for s in val_subjects for n in subjects[s]),
+            "test": sorted(n for s in test_subjects for n in subjects[s]),
+        })
+    return folds
+
+
+def write_manifest(path, data_path, folds, seed=42):
+    manifest = {
+        "data_path": data_path,
+        "n_folds": len(folds),
+        "seed": seed,
+        "folds": folds,
+    }
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(manifest_path):
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def check_fold(manifest, fold, manifest_path=""):
+    if not 0 <= fold < manifest["n_folds"]:
+        raise ValueError(f"fold {fold} is out of range: {manifest_path} has {manifest['n_folds']} folds")
+
+
+def load_fold(manifest_path, fold, data_path=None):
+    """读取指定折的训练/验证/测试文件路径；data_path 为 None 时使用清单中记录的目录"""
+    manifest = read_manifest(manifest_path)
+    if data_path is None:
+        data_path = manifest["data_path"]
+    check_fold(manifest, fold, manifest_path)
+    entry = manifest["folds"][fold]
+    return tuple([os.path.join(data_path, n) for n in entry[k]]
+                 for k in ("train", "val", "test"))
+
+
+def resolve_data_path(args):
+    """未指定 --data_path 时使用 split manifest 中记录的目录，否则使用默认目录"""
+    if args.data_path is None:
+        args.data_path = read_manifest(args.split_manifest)["data_path"] if args.split_manifest else DEFAULT_DATA_PATH
+    return args.data_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_path", type=str, default=DEFAULT_DATA_PATH,
+                        help="Directory of preprocessed NPZ files.")
+    parser.add_argument("--output", type=str, default="split.json",
+                        help="Path of the JSON split manifest.")
+    parser.add_argument("--n_folds", type=int, default=10)
+    parser.add_argument("--val_ratio", type=float, default=0.1,
+                        help="Fraction of non-test subjects used for validation.")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    fnames = sorted(glob(os.path.join(args.data_path, '*.npz')))
+    folds = make_subject_folds(fnames, args.n_folds, args.val_ratio, args.seed)
+    write_manifest(args.output, args.data_path, folds, args.seed)
+
+    for entry in folds:
+        print(f"Fold {entry['fold']}: train {len(entry['train'])}, "
+              f"val {len(entry['val'])}, test {len(entry['test'])} records")
+    print(f"Manifest saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import numpy as np
+import tensorflow as tf
+
+from model import create_model, load_model, block_filters
+from sequence import make_sequences
+
+
+def create_streaming_model(batch_model, Fs=100, n_classes=5):
+    """由批量模型构建逐epoch打分的有状态模型
+
+    CNN-SE 主干对每个epoch独立计算，只有LSTM跨epoch传递信息，因此
+    seq_length=1 的有状态模型可以直接复用批量模型的全部权重。
+    """
+    model = create_model(Fs=Fs, n_classes=n_classes, seq_length=1, summary=False, stateful=True,
+                         filters=block_filters(batch_model))
+    model.set_weights(batch_model.get_weights())
+    return model
+
+
+class StreamingStager:
+    """逐个30秒epoch在线分期
+
+    每次调用只计算一个epoch的主干和一步LSTM。reset_interval 为每隔多少个
+    epoch清空一次LSTM状态：取批量模型的 seq_length (15) 时与批量模式
+    逐epoch结果一致；取0则在整夜内持续保留状态。
+    """
+
+    def __init__(self, model, reset_interval=15):
+        self.model = model
+        self.reset_interval = reset_interval
+        self.n_steps = 0
+        self._step = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec(model.input_shape, tf.float32)]
+        )
+
+    def reset(self):
+        self.model.reset_states()
+        self.n_steps = 0
+
+    def step(self, epoch):
+        """输入一个epoch的信号 (3000,)，返回该epoch的各阶段概率 (n_classes,)"""
+        if self.reset_interval and self.n_steps == self.reset_interval:
+            self.reset()
+        x = np.asarray(epoch, dtype=np.float32).reshape(self.model.input_shape)
+        self.n_steps += 1
+        return self._step(x).numpy()[0, 0]
+
+
+def verify_against_batch(batch_model, stager, npz_path, seq_length=15):
+    """在一整夜记录上比较流式与批量模式的逐epoch输出，返回最大绝对误差"""
+    x = np.load(npz_path)['x']
+    x_seq = make_sequences(x, seq_length)[..., np.newaxis]
+    batch_probs = batch_model.predict(x_seq, verbose=0).reshape(-1, batch_model.output_shape[-1])
+
+    stager.reset()
+    stream_probs = np.stack([stager.step(epoch) for epoch in x[:len(batch_probs)]])
+    return np.abs(stream_probs - batch_probs).max()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_path", type=str, default="model.h5",
+                        help="Batch model weights (.h5) or SavedModel directory")
+    parser.add_argument("--output_dir", type=str, default="streaming_model",
+                        help="Where to save the stateful streaming SavedModel")
+    parser.add_argument("--verify_path", type=str, nargs="*", default=[],
+                        help="NPZ nights on which streaming outputs are compared with batch mode")
+    parser.add_argument("--tolerance", type=float, default=1e-4,
+                        help="Maximum allowed absolute difference of per-epoch probabilities")
+    args = parser.parse_args()
+
+    batch_model = load_model(args.model_path)
+    seq_length = batch_model.input_shape[1]
+    streaming_model = create_streaming_model(batch_model)
+    stager = StreamingStager(streaming_model, reset_interval=seq_length)
+
+    for npz_path in args.verify_path:
+        max_diff = verify_against_batch(batch_model, stager, npz_path, seq_length)
+        status = "OK" if max_diff <= args.tolerance else "MISMATCH"
+        print(f"{os.path.basename(npz_path)}: max |stream - batch| = {max_diff:.2e} ({status})")
+        if max_diff > args.tolerance:
+            raise SystemExit(f"Streaming model deviates from batch mode by more than {args.tolerance}")
+
+    streaming_model.save(args.output_dir)
+    print(f"Streaming model saved to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
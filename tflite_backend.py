@@ -0,0 +1,55 @@
+import numpy as np
+
+
+def get_interpreter_class():
+    """优先使用轻量的 ai_edge_litert / tflite_runtime，都未安装时退回 tf.lite"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite.python.interpreter import Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """TFLite解释器的简单封装，接口与 Keras 模型的 predict 一致
+
+    int8 全整数量化模型的输入/输出按张量自带的 scale / zero_point
+    自动量化与反量化。解释器在x86/ARM CPU上默认启用 XNNPACK 委托，
+    num_threads 同时决定 XNNPACK 的线程数。
+    """
+
+    def __init__(self, model_path=None, model_content=None, num_threads=None):
+        Interpreter = get_interpreter_class()
+        self.interpreter = Interpreter(
+            model_path=model_path, model_content=model_content, num_threads=num_threads
+        )
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self.input_shape = tuple(self.input_detail['shape'])
+
+    def _quantize(self, x):
+        dtype = self.input_detail['dtype']
+        if dtype == np.float32:
+            return x.astype(np.float32)
+        scale, zero_point = self.input_detail['quantization']
+        info = np.iinfo(dtype)
+        return np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, y):
+        if self.output_detail['dtype'] == np.float32:
+            return y
+        scale, zero_point = self.output_detail['quantization']
+        return (y.astype(np.float32) - zero_point) * scale
+
+    def predict(self, x, batch_size=None, verbose=0):
+        # 导出的模型固定 batch=1，逐序列调用
+        outputs = []
+        for i in range(len(x)):
+            self.interpreter.set_tensor(self.input_detail['index'], self._quantize(x[i:i + 1]))
+            self.interpreter.invoke()
+            outputs.append(self._dequantize(self.interpreter.get_tensor(self.output_detail['index'])))
+        return np.concatenate(outputs)
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sequence import make_record_sequences
+
+# ================================ 配置区域 ================================
+N_EPOCHS = 1100        # 一整夜约9小时的30秒epoch数
+N_SAMPLES = 3000       # 每个epoch的采样点数 (100 Hz * 30 s)
+SEQ_LENGTH = 15
+N_REPEATS = 5
+
+
+# ============================== 函数定义区域 ==============================
+def loop_sequences(x, y, seq_length):
+    """原 train.py 中的逐epoch循环实现"""
+    temp_ = []
+    for j in range(len(y)):
+        temp = np.zeros((5,))
+        temp[y[j]] = 1.
+        temp_.append(temp)
+    y = np.array(temp_)
+
+    X_seq, y_seq = [], []
+    for j in range(0, len(x), seq_length):
+        if j + seq_length <= len(x):
+            X_seq.append(np.array(x[j:j + seq_length]))
+            y_seq.append(np.array(y[j:j + seq_length]))
+    return np.array(X_seq), np.array(y_seq)
+
+
+def materialized_sequences(x, y, seq_length):
+    """向量化实现并拷贝为独立数组，与循环实现一样产出真实数据（训练时送入模型的形式）
+
+    make_record_sequences 返回的是视图，只计时视图构造不能与循环实现直接比较；
+    不重叠窗口的视图本身已是C连续，np.ascontiguousarray 不会拷贝，因此显式 copy。
+    """
+    x_seq, y_seq = make_record_sequences(x, y, seq_length)
+    return x_seq.copy(), y_seq.copy()
+
+
+def timeit(fn, *args):
+    best = float('inf')
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# ============================== 主程序区域 ==============================
+def main():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((N_EPOCHS, N_SAMPLES)).astype(np.float32)
+    y = rng.integers(0, 5, N_EPOCHS)
+
+    x_loop, y_loop = loop_sequences(x, y, SEQ_LENGTH)
+    x_vec, y_vec = materialized_sequences(x, y, SEQ_LENGTH)
+    assert np.array_equal(x_loop, x_vec) and np.array_equal(y_loop, y_vec)
+
+    t_loop = timeit(loop_sequences, x, y, SEQ_LENGTH)
+    t_vec = timeit(materialized_sequences, x, y, SEQ_LENGTH)
+    t_view = timeit(make_record_sequences, x, y, SEQ_LENGTH)
+    print(f"循环实现:           {t_loop * 1000:8.2f} ms")
+    print(f"向量化实现(含拷贝): {t_vec * 1000:8.2f} ms")
+    print(f"加速比:             {t_loop / t_vec:8.1f}x")
+    print(f"仅构造视图:         {t_view * 1000:8.2f} ms  (不拷贝数据，不与循环实现直接比较)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tensorflow as tf
+from model import create_model, cpu_supports_bf16
+
+# ================================ 配置区域 ================================
+BATCH_SIZE = 16
+SEQ_LENGTH = 15
+N_WARMUP = 3           # 预热步数（包含图追踪/XLA编译）
+N_STEPS = 20           # 计时步数
+
+
+# ============================== 函数定义区域 ==============================
+def steps_per_second(model, x, y):
+    for _ in range(N_WARMUP):
+        model.train_on_batch(x, y)
+    start = time.perf_counter()
+    for _ in range(N_STEPS):
+        model.train_on_batch(x, y)
+    return N_STEPS / (time.perf_counter() - start)
+
+
+# ============================== 主程序区域 ==============================
+def main():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((BATCH_SIZE, SEQ_LENGTH, 3000, 1)).astype(np.float32)
+    y = np.eye(5, dtype=np.float32)[rng.integers(0, 5, (BATCH_SIZE, SEQ_LENGTH))]
+
+    print(f"bfloat16 CPU支持: {cpu_supports_bf16()}")
+    variants = [
+        ("float32", dict()),
+        ("float32 + XLA", dict(jit_compile=True)),
+        ("mixed_bfloat16", dict(mixed_precision=True)),
+        ("mixed_bfloat16 + XLA", dict(jit_compile=True, mixed_precision=True)),
+    ]
+    results = []
+    for name, kwargs in variants:
+        tf.keras.backend.clear_session()
+        model = create_model(seq_length=SEQ_LENGTH, summary=False, **kwargs)
+        results.append((name, steps_per_second(model, x, y)))
+
+    baseline = results[0][1]
+    for name, sps in results:
+        print(f"{name:>22}: {sps:6.2f} steps/s ({sps / baseline:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
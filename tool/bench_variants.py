@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+from glob import glob
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tensorflow as tf
+from custom_layers import SqueezeExcite1D
+from export_lite import load_record_sequences, stage_kappa
+from keras_backend import KerasPredictor
+from model import create_model, load_model, block_filters
+
+# ================================ 配置区域 ================================
+ARCH = 'model'                  # model: create_model；lite: create_optimized_model
+SEQ_LENGTH = 15
+WIDTHS = [1.0, 0.75, 0.5, 0.25]  # 只统计FLOPs与延迟的宽度系数（未训练，不计算kappa）
+CHECKPOINTS = [                 # (名称, 路径)：训练好的原始/缩放/剪枝模型，计算kappa
+    # ('baseline', 'model.h5'),
+    # ('pruned 50%', 'model_pruned.h5'),
+]
+DATA_PATH = 'E:/DREAMT base/sleep-edf/sleep-edf-database-expanded-1.0.0/sleep-cassette/eeg_fpz_cz'
+EVAL_RECORDS = 10               # 计算kappa用的记录数
+EVAL_SEQUENCES = 500
+N_WINDOWS = 64                  # 每次计时推理的窗口数（约一整夜，步长15）
+N_WARMUP = 2
+N_RUNS = 5
+
+
+# ============================== 函数定义区域 ==============================
+def count_flops(model):
+    """统计每个15-epoch窗口的浮点运算数（乘加计2次，只计卷积/全连接/LSTM）"""
+    flops = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.Conv1D):
+            kernel_size, in_channels, filters = layer.kernel.shape
+            flops += 2 * np.prod(layer.output_shape[1:-1]) * kernel_size * in_channels * filters
+        elif isinstance(layer, SqueezeExcite1D):
+            for dense in (layer.squeeze_dense, layer.excite_dense):
+                flops += 2 * np.prod(layer.output_shape[1:-2]) * np.prod(dense.kernel.shape)
+        elif isinstance(layer, tf.keras.layers.LSTM):
+            kernel, recurrent_kernel = layer.cell.kernel, layer.cell.recurrent_kernel
+            flops += 2 * layer.input_shape[1] * (np.prod(kernel.shape) + np.prod(recurrent_kernel.shape))
+        elif isinstance(layer, tf.keras.layers.Dense):
+            flops += 2 * np.prod(layer.output_shape[1:-1]) * np.prod(layer.kernel.shape)
+    return int(flops)
+
+
+def latency_ms(model, x):
+    """整批窗口推理的平均耗时，换算为每个窗口的毫秒数"""
+    predictor = KerasPredictor(model)
+    for _ in range(N_WARMUP):
+        predictor.predict(x)
+    start = time.perf_counter()
+    for _ in range(N_RUNS):
+        predictor.predict(x)
+    return (time.perf_counter() - start) / N_RUNS / len(x) * 1000
+
+
+def build(width=None, path=None):
+    if ARCH == 'lite':
+        from model_lite import create_optimized_model, load_optimized_model
+        if path is not None:
+            return load_optimized_model(path, SEQ_LENGTH)
+        return create_optimized_model(seq_length=SEQ_LENGTH, summary=False, width=width)
+    if path is not None:
+        return load_model(path, SEQ_LENGTH)
+    return create_model(seq_length=SEQ_LENGTH, summary=False, width=width)
+
+
+# ============================== 主程序区域 ==============================
+def main():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((N_WINDOWS, SEQ_LENGTH, 3000, 1)).astype(np.float32)
+
+    eval_x = eval_y = None
+    if CHECKPOINTS:
+        fnames = sorted(glob(os.path.join(DATA_PATH, '*.npz')))[-EVAL_RECORDS:]
+        eval_x, eval_y = load_record_sequences(fnames, SEQ_LENGTH, EVAL_SEQUENCES)
+
+    variants = [(f'width {w:g}', dict(width=w)) for w in WIDTHS]
+    variants += [(name, dict(path=path)) for name, path in CHECKPOINTS]
+
+    rows = []
+    for name, kwargs in variants:
+        tf.keras.backend.clear_session()
+        model = build(**kwargs)
+        kappa = stage_kappa(model, eval_x, eval_y) if 'path' in kwargs else None
+        rows.append((name, block_filters(model), model.count_params(), count_flops(model),
+                     latency_ms(model, x), kappa))
+
+    base_flops = rows[0][3]
+    print(f"{'variant':>14} | {'filters':>14} | {'params':>9} | {'MFLOPs':>8} | {'rel':>5} | {'ms/window':>9} | kappa")
+    for name, filters, params, flops, ms, kappa in rows:
+        kappa = f"{kappa:.4f}" if kappa is not None else "-"
+        print(f"{name:>14} | {str(filters):>14} | {params:>9} | {flops / 1e6:8.1f} | "
+              f"{flops / base_flops:5.2f} | {ms:9.2f} | {kappa}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,22 @@
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 from collections import Counter
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NPZ_PATH = 'E:/DREAMT base/sleep-edf/sleep-edf-database-expanded-1.0.0/sleep-cassette/eeg_fpz_cz/SC4041E0.npz'  # 替换为实际文件路径
+MODEL_PATH = None  # 设为模型路径时绘制模型预测的睡眠阶段
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sleep_staging', 'hypnograms')  # 结果缓存命中时不会重新推理；None 不使用缓存
+
 # 加载数据
-data = np.load('E:/DREAMT base/sleep-edf/sleep-edf-database-expanded-1.0.0/sleep-cassette/eeg_fpz_cz/SC4041E0.npz')  # 替换为实际文件路径
-y = data['y']  # 真实标签
+if MODEL_PATH is not None:
+    from infer import score_npz
+    y, _, _ = score_npz(NPZ_PATH, MODEL_PATH, cache_dir=CACHE_DIR)  # 模型预测
+else:
+    data = np.load(NPZ_PATH)
+    y = data['y']  # 真实标签
 
 # 睡眠阶段映射（英文）
 stage_map = {
@@ -1,136 +1,474 @@
+import argparse
+import hashlib
 import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 from glob import glob
-import seaborn as sns
 import matplotlib.pyplot as plt
 plt.rcParams.update({'font.size': 13})
 
-import tensorflow as tf
-config = tf.compat.v1.ConfigProto()
-# config.gpu_options.per_process_gpu_memory_fraction = 0.4
-config.gpu_options.allow_growth=True
-sess = tf.compat.v1.Session(config=config)
-
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, confusion_matrix, classification_report, cohen_kappa_score
-from model import create_model
+from sequence import make_record_sequences, epoch_probabilities
+from sequence_cache import open_cache, sequence_starts
+from split import load_fold, make_subject_folds, write_manifest, read_manifest, resolve_data_path, DEFAULT_DATA_PATH
+from result_cache import hash_path
+
+
+label = ['Wake', 'N1', 'N2', 'N3', 'REM']
+
+
+def configure_tensorflow(intra_op_threads=0, inter_op_threads=0):
+    """导入并配置TensorFlow；只在真正训练的进程中调用，--folds 的调度进程和 --help 不会导入TF
+
+    线程数必须在TF运行时初始化（创建Session）之前设置。
+    """
+    import tensorflow as tf
+    if intra_op_threads > 0:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads > 0:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    config = tf.compat.v1.ConfigProto()
+    # config.gpu_options.per_process_gpu_memory_fraction = 0.4
+    config.gpu_options.allow_growth=True
+    tf.compat.v1.Session(config=config)
 
 
 ## data preparation
-data_path = 'E:/DREAMT base/sleep-edf/sleep-edf-database-expanded-1.0.0/sleep-cassette/eeg_fpz_cz'
-# data_path = 'data/ISRUC_S1'
-
-fnames = sorted(glob(os.path.join(data_path, '*.npz')))
-
-X, y = [], []
-for fname in fnames:
-    samples = np.load(fname)
-    X.append(samples['x'])
-    y.append(samples['y'])
-
-# one-hot encoding sleep stages    
-temp_y = []
-for i in range(len(y)):
-    temp_ = []
-    for j in range(len(y[i])):
-        temp = np.zeros((5,))
-        temp[y[i][j]] = 1.
-        temp_.append(temp)
-    temp_y.append(np.array(temp_))
-y = temp_y    
-
-# make sequence data
-seq_length = 15
-
-X_seq, y_seq = [], []
-for i in range(len(X)):
-    for j in range(0, len(X[i]), seq_length): # discard last short sequence
-        if j+seq_length < len(X[i]):
-            X_seq.append(np.array(X[i][j:j+seq_length]))
-            y_seq.append(np.array(y[i][j:j+seq_length]))
-            
-X_seq = np.array(X_seq)
-y_seq = np.array(y_seq)
-
-X_seq_train, X_seq_test, y_seq_train, y_seq_test = train_test_split(X_seq, y_seq, test_size=0.1, random_state=42)
-X_seq_train, X_seq_val, y_seq_train, y_seq_val = train_test_split(X_seq_train, y_seq_train, test_size=0.1, random_state=42)
-
-X_seq_train = np.expand_dims(X_seq_train, -1)
-X_seq_val = np.expand_dims(X_seq_val, -1)
-X_seq_test = np.expand_dims(X_seq_test, -1)
-
-## model training
-checkpoint = tf.keras.callbacks.ModelCheckpoint(filepath='model', monitor='val_loss', verbose=1, save_best_only=True)
-early = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=20, verbose=1)
-redonplat = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', patience=5, verbose=1)
-csv_logger = tf.keras.callbacks.CSVLogger('log.csv', separator=',', append=True)
-callbacks_list = [
-    checkpoint,
-    early,
-    redonplat,
-    csv_logger,
-    ]
-    
-model = create_model(seq_length=seq_length)
-
-hist = model.fit(X_seq_train, y_seq_train, batch_size=16, epochs=100, verbose=1,
-                 validation_data=(X_seq_val, y_seq_val), callbacks=callbacks_list)
-
-plt.figure(figsize=(15,5))
-plt.subplot(1,2,1)
-plt.plot(hist.history['accuracy'])
-plt.plot(hist.history['val_accuracy'])
-plt.xlabel('Epoch')
-plt.ylabel('Accuracy')
-plt.legend(['Training', 'Validation'], loc='lower right')
-
-plt.subplot(1,2,2)
-plt.plot(hist.history['loss'])
-plt.plot(hist.history['val_loss'])
-plt.xlabel('Epoch')
-plt.ylabel('Loss')
-plt.legend(['Training', 'Validation'], loc='upper right')
-
-plt.suptitle('hist')
-plt.savefig('hist.png')
-plt.close()
-
-model.save('model.h5')
+def load_sequences(fnames, seq_length=15):
+    """一次性读取全部NPZ并切分为序列（内存模式）"""
+    X_seq, y_seq = [], []
+    for fname in fnames:
+        samples = np.load(fname)
+        x_rec, y_rec = make_record_sequences(samples['x'], samples['y'], seq_length)
+        X_seq.append(x_rec)
+        y_seq.append(y_rec)
+
+    X_seq = np.concatenate(X_seq)
+    y_seq = np.concatenate(y_seq)
+    return X_seq, y_seq
+
+
+def get_callbacks(output_dir='.'):
+    import tensorflow as tf
+    checkpoint = tf.keras.callbacks.ModelCheckpoint(filepath=os.path.join(output_dir, 'model'), monitor='val_loss', verbose=1, save_best_only=True)
+    early = tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=20, verbose=1)
+    redonplat = tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', patience=5, verbose=1)
+    csv_logger = tf.keras.callbacks.CSVLogger(os.path.join(output_dir, 'log.csv'), separator=',', append=True)
+    return [
+        checkpoint,
+        early,
+        redonplat,
+        csv_logger,
+        ]
+
+
+def plot_history(hist, output_dir='.'):
+    plt.figure(figsize=(15,5))
+    plt.subplot(1,2,1)
+    plt.plot(hist.history['accuracy'])
+    plt.plot(hist.history['val_accuracy'])
+    plt.xlabel('Epoch')
+    plt.ylabel('Accuracy')
+    plt.legend(['Training', 'Validation'], loc='lower right')
+
+    plt.subplot(1,2,2)
+    plt.plot(hist.history['loss'])
+    plt.plot(hist.history['val_loss'])
+    plt.xlabel('Epoch')
+    plt.ylabel('Loss')
+    plt.legend(['Training', 'Validation'], loc='upper right')
+
+    plt.suptitle('hist')
+    plt.savefig(os.path.join(output_dir, 'hist.png'))
+    plt.close()
+
 
 ## output
-y_seq_pred = model.predict(X_seq_test, batch_size=1)
+def evaluate(y_seq_test, y_seq_pred, output_dir='.'):
+    import seaborn as sns  # 依赖scipy，导入较慢，只在绘制混淆矩阵时导入
+    y_seq_pred_ = y_seq_pred.reshape(-1,5)
+    y_seq_test_ = y_seq_test.reshape(-1,5)
+    y_seq_pred_ = np.array([np.argmax(s) for s in y_seq_pred_])
+    y_seq_test_ = np.array([np.argmax(s) for s in y_seq_test_])
+
+    accuracy = accuracy_score(y_seq_test_, y_seq_pred_)
+    print('accuracy:', accuracy)
+
+    kappa = cohen_kappa_score(y_seq_test_, y_seq_pred_)
+    print('kappa:', kappa)
+
+    report = classification_report(y_true=y_seq_test_, y_pred=y_seq_pred_, target_names=label, output_dict=True)
+    print('report:', report)
+    report = pd.DataFrame(report).transpose()
+    report.to_csv(os.path.join(output_dir, 'report.csv'), index= True)
+
+    cm = confusion_matrix(y_seq_test_, y_seq_pred_)
+    sns.heatmap(cm, square=True, annot=True, fmt='d', cmap='YlGnBu', xticklabels=label, yticklabels=label)
+    plt.xlabel('predicted label')
+    plt.ylabel('true label')
+    plt.savefig(os.path.join(output_dir, 'cm.png'), bbox_inches='tight', dpi=300)
+    plt.close()
+
+    cm_norm = confusion_matrix(y_seq_test_, y_seq_pred_, normalize='true')
+    sns.heatmap(cm_norm, square=True, annot=True, cmap='YlGnBu', xticklabels=label, yticklabels=label)
+    plt.xlabel('predicted label')
+    plt.ylabel('true label')
+    plt.savefig(os.path.join(output_dir, 'cm_norm.png'), bbox_inches='tight', dpi=300)
+    plt.close()
+
+    return accuracy, kappa
+
+
+def split_records(fnames, args):
+    """按记录划分训练/验证/测试集，指定 split manifest 时读取对应折"""
+    if args.split_manifest is not None:
+        return load_fold(args.split_manifest, args.fold, args.data_path)
+    fnames_train, fnames_test = train_test_split(fnames, test_size=0.1, random_state=42)
+    fnames_train, fnames_val = train_test_split(fnames_train, test_size=0.1, random_state=42)
+    return fnames_train, fnames_val, fnames_test
+
+
+def train_in_memory(fnames, args):
+    from model import create_model
+    if args.split_manifest is not None:
+        # 按受试者划分时每个子集只读取本折的记录
+        fnames_train, fnames_val, fnames_test = split_records(fnames, args)
+        X_seq_train, y_seq_train = load_sequences(fnames_train, args.seq_length)
+        X_seq_val, y_seq_val = load_sequences(fnames_val, args.seq_length)
+        X_seq_test, y_seq_test = load_sequences(fnames_test, args.seq_length)
+    else:
+        X_seq, y_seq = load_sequences(fnames, args.seq_length)
+
+        X_seq_train, X_seq_test, y_seq_train, y_seq_test = train_test_split(X_seq, y_seq, test_size=0.1, random_state=42)
+        X_seq_train, X_seq_val, y_seq_train, y_seq_val = train_test_split(X_seq_train, y_seq_train, test_size=0.1, random_state=42)
+
+    X_seq_train = np.expand_dims(X_seq_train, -1)
+    X_seq_val = np.expand_dims(X_seq_val, -1)
+    X_seq_test = np.expand_dims(X_seq_test, -1)
+
+    ## model training
+    model = create_model(seq_length=args.seq_length, jit_compile=args.jit_compile, mixed_precision=args.mixed_precision)
+
+    hist = model.fit(X_seq_train, y_seq_train, batch_size=args.batch_size, epochs=args.epochs, verbose=1,
+                     validation_data=(X_seq_val, y_seq_val), callbacks=get_callbacks(args.output_dir))
+
+    y_seq_pred = model.predict(X_seq_test, batch_size=1)
+    return model, hist, y_seq_test, y_seq_pred
+
+
+def train_streaming(fnames, args):
+    from model import create_model
+    from data_pipeline import make_sequence_dataset
+    # 流式模式下无法在序列级别全局打乱，按记录划分训练/验证/测试集
+    fnames_train, fnames_val, fnames_test = split_records(fnames, args)
+
+    dataset_kwargs = dict(seq_length=args.seq_length, batch_size=args.batch_size,
+                          shuffle_buffer=args.shuffle_buffer, cycle_length=args.cycle_length)
+    train_ds = make_sequence_dataset(fnames_train, shuffle=True, **dataset_kwargs)
+    val_ds = make_sequence_dataset(fnames_val, shuffle=False, **dataset_kwargs)
+    test_ds = make_sequence_dataset(fnames_test, shuffle=False, **dataset_kwargs)
+
+    ## model training
+    model = create_model(seq_length=args.seq_length, jit_compile=args.jit_compile, mixed_precision=args.mixed_precision)
+
+    hist = model.fit(train_ds, epochs=args.epochs, verbose=1,
+                     validation_data=val_ds, callbacks=get_callbacks(args.output_dir))
+
+    y_seq_test, y_seq_pred = [], []
+    for x_batch, y_batch in test_ds:
+        y_seq_test.append(y_batch.numpy())
+        y_seq_pred.append(model.predict_on_batch(x_batch))
+    return model, hist, np.concatenate(y_seq_test), np.concatenate(y_seq_pred)
+
+
+def train_cached(fnames, args):
+    from model import create_model
+    from data_pipeline import CachedSequenceLoader
+    # 首次运行编译缓存，之后直接以内存映射方式打开
+    x, y, records = open_cache(fnames, args.cache_dir)
+
+    if args.split_manifest is not None:
+        subsets = [set(os.path.basename(f) for f in subset) for subset in split_records(fnames, args)]
+        starts_train, starts_val, starts_test = [
+            sequence_starts([r for r in records if r['name'] in subset], args.seq_length)
+            for subset in subsets]
+    else:
+        starts = sequence_starts(records, args.seq_length)
+
+        starts_train, starts_test = train_test_split(starts, test_size=0.1, random_state=42)
+        starts_train, starts_val = train_test_split(starts_train, test_size=0.1, random_state=42)
+
+    loader_kwargs = dict(seq_length=args.seq_length, batch_size=args.batch_size)
+    train_loader = CachedSequenceLoader(x, y, starts_train, shuffle=True, **loader_kwargs)
+    val_loader = CachedSequenceLoader(x, y, starts_val, shuffle=False, **loader_kwargs)
+    test_loader = CachedSequenceLoader(x, y, starts_test, shuffle=False, **loader_kwargs)
+
+    ## model training
+    model = create_model(seq_length=args.seq_length, jit_compile=args.jit_compile, mixed_precision=args.mixed_precision)
+
+    hist = model.fit(train_loader, epochs=args.epochs, verbose=1,
+                     validation_data=val_loader, callbacks=get_callbacks(args.output_dir))
+
+    y_seq_test = np.concatenate([test_loader[i][1] for i in range(len(test_loader))])
+    y_seq_pred = model.predict(test_loader)
+    return model, hist, y_seq_test, y_seq_pred
+
+
+def teacher_log_probs(teacher_path, fnames, seq_length=15, cache_dir='teacher_cache'):
+    """逐记录计算教师模型的log概率 (n_seq, seq_length, n_classes) 并缓存到磁盘
+
+    缓存按 (教师权重哈希, 记录路径/大小/修改时间, seq_length) 命名，命中时不读取
+    记录内容；教师模型只在缓存缺失时加载，每条记录只推理一次，训练的每个epoch
+    都直接读取缓存。
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    teacher_hash = hash_path(teacher_path)
+    teacher = None
+    log_probs = []
+    for fname in fnames:
+        stat = os.stat(fname)
+        record = f"{os.path.abspath(fname)}|{stat.st_size}|{stat.st_mtime_ns}"
+        key = hashlib.sha1(f"{teacher_hash}|{record}|{seq_length}".encode()).hexdigest()
+        path = os.path.join(cache_dir, key + '.npy')
+        if not os.path.exists(path):
+            x_rec, y_rec = load_sequences([fname], seq_length)
+            if len(x_rec) == 0:
+                # 短于一个序列的记录与 load_sequences 一样跳过，缓存空数组
+                probs = np.empty((0, seq_length, y_rec.shape[-1]), dtype=np.float32)
+            else:
+                if teacher is None:
+                    from model import load_model
+                    teacher = load_model(teacher_path, seq_length)
+                probs = epoch_probabilities(teacher.predict(x_rec[..., np.newaxis], batch_size=32, verbose=0))
+            tmp_path = f'{path}.{os.getpid()}.tmp'  # 多折并行时各进程写各自的临时文件
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.log(np.clip(probs, 1e-7, 1.0)).astype(np.float32))
+            os.replace(tmp_path, path)
+        log_probs.append(np.load(path))
+    return np.concatenate(log_probs)
+
+
+def student_logits_model(student):
+    """取 create_optimized_model 中 Softmax 之前的输出，整理为 (n, seq_length, n_classes) 的logits
+
+    返回的模型与学生模型共享权重，用于蒸馏训练。
+    """
+    import tensorflow as tf
+    x = student.layers[-1].input  # (n, n_classes, seq_length, 1)
+    x = tf.keras.layers.Permute((2, 1, 3))(x)
+    x = tf.keras.layers.Reshape((x.shape[1], x.shape[2]))(x)
+    return tf.keras.Model(student.input, x)
+
+
+def train_distill(fnames, args):
+    """以 --distill_teacher 为教师，用软目标 + Focal Loss 训练 model_lite 学生模型"""
+    import tensorflow as tf
+    from custom_layers import DistillationLoss
+    from model_lite import create_optimized_model
+
+    fnames_train, fnames_val, fnames_test = split_records(fnames, args)
+    cache_dir = args.teacher_cache_dir or os.path.join(args.output_dir, 'teacher_cache')
+
+    def load_subset(subset):
+        x_seq, y_seq = load_sequences(subset, args.seq_length)
+        teacher = teacher_log_probs(args.distill_teacher, subset, args.seq_length, cache_dir)
+        return x_seq[..., np.newaxis], np.concatenate([y_seq, teacher], axis=-1)
+
+    X_seq_train, y_seq_train = load_subset(fnames_train)
+    X_seq_val, y_seq_val = load_subset(fnames_val)
+    X_seq_test, y_seq_test = load_subset(fnames_test)
+    n_classes = y_seq_test.shape[-1] // 2
+
+    # 教师在测试集上的结果直接来自缓存，作为对照
+    teacher_kappa = cohen_kappa_score(y_seq_test[..., :n_classes].argmax(-1).reshape(-1),
+                                      y_seq_test[..., n_classes:].argmax(-1).reshape(-1))
+    print(f"teacher kappa: {teacher_kappa:.4f}")
+
+    ## model training
+    student = create_optimized_model(seq_length=args.seq_length, summary=False, width=args.student_width)
+    model = student_logits_model(student)
+    accuracy = tf.keras.metrics.MeanMetricWrapper(
+        lambda y_true, y_pred: tf.keras.metrics.categorical_accuracy(y_true[..., :n_classes], y_pred),
+        name='accuracy')
+    model.compile(optimizer='adam',
+                  loss=DistillationLoss(n_classes, args.distill_alpha, args.temperature),
+                  metrics=[accuracy])
+
+    # 检查点回调保存的是训练用的logits视图，这里不使用
+    callbacks = [c for c in get_callbacks(args.output_dir) if not isinstance(c, tf.keras.callbacks.ModelCheckpoint)]
+    hist = model.fit(X_seq_train, y_seq_train, batch_size=args.batch_size, epochs=args.epochs, verbose=1,
+                     validation_data=(X_seq_val, y_seq_val), callbacks=callbacks)
+
+    y_seq_pred = epoch_probabilities(student.predict(X_seq_test, batch_size=1))
+    return student, hist, y_seq_test[..., :n_classes], y_seq_pred
+
+
+def fold_command(args, fold, intra_op_threads, inter_op_threads):
+    """生成单折训练子进程的命令行"""
+    cmd = [sys.executable, os.path.abspath(__file__),
+           "--data_path", args.data_path,
+           "--output_dir", os.path.join(args.output_dir, f"fold_{fold:02d}"),
+           "--seq_length", str(args.seq_length),
+           "--batch_size", str(args.batch_size),
+           "--epochs", str(args.epochs),
+           "--split_manifest", args.split_manifest,
+           "--fold", str(fold),
+           "--intra_op_threads", str(intra_op_threads),
+           "--inter_op_threads", str(inter_op_threads)]
+    if args.streaming:
+        cmd += ["--streaming",
+                "--shuffle_buffer", str(args.shuffle_buffer),
+                "--cycle_length", str(args.cycle_length)]
+    elif args.cache_dir is not None:
+        cmd += ["--cache_dir", args.cache_dir]
+    if args.distill_teacher is not None:
+        cmd += ["--distill_teacher", args.distill_teacher,
+                "--temperature", str(args.temperature),
+                "--distill_alpha", str(args.distill_alpha),
+                "--student_width", str(args.student_width),
+                "--teacher_cache_dir", args.teacher_cache_dir or os.path.join(args.output_dir, 'teacher_cache')]
+    if args.jit_compile:
+        cmd.append("--jit_compile")
+    if args.mixed_precision:
+        cmd.append("--mixed_precision")
+    return cmd
+
+
+def run_folds(fnames, args):
+    """在独立的CPU进程中并行训练各折，并汇总各折结果"""
+    if args.split_manifest is None:
+        args.split_manifest = os.path.join(args.output_dir, 'split.json')
+        write_manifest(args.split_manifest, args.data_path, make_subject_folds(fnames, args.folds))
+    # 折数超出清单时在启动子进程前报错，而不是在子进程中抛出 IndexError
+    n_folds = read_manifest(args.split_manifest)["n_folds"]
+    if args.folds > n_folds:
+        raise ValueError(f"--folds {args.folds} exceeds the {n_folds} folds in {args.split_manifest}")
+    if args.cache_dir is not None:
+        # 在启动子进程前编译好缓存，避免多个进程同时写入
+        open_cache(fnames, args.cache_dir)
+
+    intra_op_threads = args.intra_op_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    inter_op_threads = args.inter_op_threads or 1
+
+    def run_fold(fold):
+        cmd = fold_command(args, fold, intra_op_threads, inter_op_threads)
+        fold_dir = cmd[cmd.index("--output_dir") + 1]
+        os.makedirs(fold_dir, exist_ok=True)
+        print(f"Fold {fold}: {' '.join(cmd)}")
+        with open(os.path.join(fold_dir, 'train.log'), 'w') as log_f:
+            returncode = subprocess.call(cmd, stdout=log_f, stderr=subprocess.STDOUT)
+        print(f"Fold {fold} finished with exit code {returncode}")
+        return fold, fold_dir, returncode
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(run_fold, range(args.folds)))
+
+    # 汇总：逐折指标 + 合并所有测试集预测后的整体报告
+    rows, y_seq_test, y_seq_pred = [], [], []
+    for fold, fold_dir, returncode in results:
+        pred_path = os.path.join(fold_dir, 'predictions.npz')
+        if returncode != 0 or not os.path.exists(pred_path):
+            print(f"Fold {fold} failed, see {os.path.join(fold_dir, 'train.log')}")
+            continue
+        preds = np.load(pred_path)
+        y_true_ = preds['y_true'].reshape(-1, 5).argmax(-1)
+        y_pred_ = preds['y_pred'].reshape(-1, 5).argmax(-1)
+        rows.append({
+            'fold': fold,
+            'accuracy': accuracy_score(y_true_, y_pred_),
+            'kappa': cohen_kappa_score(y_true_, y_pred_),
+            'n_epochs': len(y_true_),
+            'checkpoint': os.path.join(fold_dir, 'model.h5'),
+        })
+        y_seq_test.append(preds['y_true'])
+        y_seq_pred.append(preds['y_pred'])
+
+    if not rows:
+        raise RuntimeError("All folds failed.")
+    folds_df = pd.DataFrame(rows)
+    print(folds_df)
+    folds_df.to_csv(os.path.join(args.output_dir, 'folds.csv'), index=False)
+
+    return evaluate(np.concatenate(y_seq_test), np.concatenate(y_seq_pred), args.output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data_path", type=str, default=None,
+                        help="Directory of preprocessed NPZ files (default: the split manifest's data_path, "
+                             f"else {DEFAULT_DATA_PATH}).")
+    # parser.add_argument("--data_path", type=str, default="data/ISRUC_S1")
+    parser.add_argument("--output_dir", type=str, default=".",
+                        help="Directory where to save model, logs and figures.")
+    parser.add_argument("--seq_length", type=int, default=15)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--epochs", type=int, default=100)
+    # 流式读取、序列缓存与蒸馏（内存中读取并附加教师软目标）是互斥的训练数据来源
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--streaming", action="store_true",
+                        help="Stream sequences from NPZ files through tf.data instead of loading all into RAM.")
+    parser.add_argument("--shuffle_buffer", type=int, default=1024,
+                        help="Number of sequences held in the shuffle buffer (streaming mode).")
+    parser.add_argument("--cycle_length", type=int, default=4,
+                        help="Number of NPZ records read in parallel (streaming mode).")
+    source.add_argument("--cache_dir", type=str, default=None,
+                        help="Compile NPZ files into a memory-mapped sequence cache in this directory and train from it.")
+    parser.add_argument("--split_manifest", type=str, default=None,
+                        help="JSON manifest written by split.py; enables subject-wise train/val/test split.")
+    parser.add_argument("--fold", type=int, default=0,
+                        help="Fold of the split manifest to train on.")
+    parser.add_argument("--jit_compile", action="store_true",
+                        help="Compile the training step with XLA.")
+    parser.add_argument("--mixed_precision", action="store_true",
+                        help="Use the mixed_bfloat16 policy when the CPU supports bfloat16.")
+    source.add_argument("--distill_teacher", type=str, default=None,
+                        help="Train a model_lite student on soft targets from this teacher checkpoint (e.g. model.h5).")
+    parser.add_argument("--temperature", type=float, default=2.0,
+                        help="Softmax temperature applied to teacher and student logits (distillation).")
+    parser.add_argument("--distill_alpha", type=float, default=0.5,
+                        help="Weight of the soft-target loss; 1 - alpha weights the focal loss on hard labels.")
+    parser.add_argument("--student_width", type=float, default=1.0,
+                        help="Width multiplier of the model_lite student.")
+    parser.add_argument("--teacher_cache_dir", type=str, default=None,
+                        help="Where teacher log-probabilities are cached (default: <output_dir>/teacher_cache).")
+    parser.add_argument("--folds", type=int, default=0,
+                        help="Train all N folds of the split manifest in worker processes and aggregate the reports.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of folds trained in parallel (with --folds).")
+    parser.add_argument("--intra_op_threads", type=int, default=0,
+                        help="TensorFlow intra-op threads per process (0: default, or cpu_count / workers with --folds).")
+    parser.add_argument("--inter_op_threads", type=int, default=0,
+                        help="TensorFlow inter-op threads per process (0: default, or 1 with --folds).")
+    args = parser.parse_args()
 
-y_seq_pred_ = y_seq_pred.reshape(-1,5)
-y_seq_test_ = y_seq_test.reshape(-1,5)
-y_seq_pred_ = np.array([np.argmax(s) for s in y_seq_pred_])
-y_seq_test_ = np.array([np.argmax(s) for s in y_seq_test_])
+    os.makedirs(args.output_dir, exist_ok=True)
+    fnames = sorted(glob(os.path.join(resolve_data_path(args), '*.npz')))
 
-accuracy = accuracy_score(y_seq_test_, y_seq_pred_)
-print('accuracy:', accuracy)
+    if args.folds > 0:
+        run_folds(fnames, args)
+        return
 
-kappa = cohen_kappa_score(y_seq_test_, y_seq_pred_)
-print('kappa:', kappa)
+    configure_tensorflow(args.intra_op_threads, args.inter_op_threads)
 
-label = ['Wake', 'N1', 'N2', 'N3', 'REM']  
+    if args.distill_teacher is not None:
+        model, hist, y_seq_test, y_seq_pred = train_distill(fnames, args)
+    elif args.streaming:
+        model, hist, y_seq_test, y_seq_pred = train_streaming(fnames, args)
+    elif args.cache_dir is not None:
+        model, hist, y_seq_test, y_seq_pred = train_cached(fnames, args)
+    else:
+        model, hist, y_seq_test, y_seq_pred = train_in_memory(fnames, args)
 
-report = classification_report(y_true=y_seq_test_, y_pred=y_seq_pred_, target_names=label, output_dict=True)
-print('report:', report) 
-report = pd.DataFrame(report).transpose()
-report.to_csv('report.csv', index= True)
+    plot_history(hist, args.output_dir)
+    model.save(os.path.join(args.output_dir, 'model.h5'))
+    np.savez(os.path.join(args.output_dir, 'predictions.npz'), y_true=y_seq_test, y_pred=y_seq_pred)
 
-cm = confusion_matrix(y_seq_test_, y_seq_pred_)
-sns.heatmap(cm, square=True, annot=True, fmt='d', cmap='YlGnBu', xticklabels=label, yticklabels=label)
-plt.xlabel('predicted label')
-plt.ylabel('true label')
-plt.savefig('cm.png', bbox_inches='tight', dpi=300)
-plt.close()
+    evaluate(y_seq_test, y_seq_pred, args.output_dir)
 
-cm_norm = confusion_matrix(y_seq_test_, y_seq_pred_, normalize='true')
-sns.heatmap(cm_norm, square=True, annot=True, cmap='YlGnBu', xticklabels=label, yticklabels=label)
-plt.xlabel('predicted label')
-plt.ylabel('true label')
-plt.savefig('cm_norm.png', bbox_inches='tight', dpi=300)
-plt.close()
 
-    
\ No newline at end of file
+if __name__ == "__main__":
+    main()